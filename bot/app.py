@@ -2,9 +2,17 @@
 
 import asyncio
 import atexit
+import hashlib
 import json
-import re
+import os
 import sys
+from typing import Iterable
+
+# orjson is optional; both parsers accept bytes and raise json.JSONDecodeError subclasses
+try:
+    import orjson as _json_fast
+except ImportError:
+    _json_fast = json
 
 from telegram import Update
 from telegram.ext import (
@@ -15,19 +23,26 @@ from telegram.ext import (
 )
 
 from bot.config import (
-    ALLOWED_USERS, ACTIVE_STREAMS_FILE, RESTART_MESSAGES_FILE,
-    RESTART_STATE_FILE, SESSION_FILE, TELEGRAM_BOT_TOKEN, WORKING_DIR,
+    ALLOWED_USERS, ACTIVE_STREAMS_FILE, BOT_COMMANDS_HASH_FILE, RESTART_MESSAGES_FILE,
+    RESTART_STATE_FILE, SESSION_FILE, TELEGRAM_BOT_TOKEN, WORKING_DIR, WORKSPACES_DIR,
 )
 from bot.logging_setup import logger, infra_logger
-from bot.sessions import get_session_id
-from bot.streams import load_active_streams
+from bot.sessions import flush_sessions, get_session_id, request_ctx
+from bot.streams import flush_active_streams, load_active_streams
+from bot.downloads import prune_partial_downloads
 from bot.workspaces import get_working_dir
-from bot.renderer import TelegramRenderer, split_message
+from bot.renderer import (
+    TelegramRenderer, is_balanced_html, iter_split_message, split_message, strip_tags,
+)
 from bot.claude import stream_claude
 from bot.sdk_session import HAS_SDK, cleanup_idle_sessions, shutdown_sdk_sessions
 from bot import handlers
 from commands import register_all, ALL_COMMANDS
 
+# Interrupted generations resumed at once after a restart; the rest wait, so a
+# large backlog doesn't start dozens of Claude processes and sends together
+MAX_CONCURRENT_RESUMES = 5
+
 
 def main() -> None:
     """Start the bot."""
@@ -49,6 +64,8 @@ def main() -> None:
     infra_logger.info("Bot starting — users=%s, workdir=%s", ALLOWED_USERS, WORKING_DIR)
 
     atexit.register(lambda: infra_logger.info("Bot process exiting"))
+    atexit.register(flush_active_streams)
+    atexit.register(flush_sessions)
 
     renderer = TelegramRenderer()
 
@@ -56,7 +73,7 @@ def main() -> None:
         """Fetch bot info at startup and resume interrupted generations."""
         bot = application.bot
         me = await bot.get_me()
-        handlers.BOT_USERNAME = me.username or ""
+        handlers.set_bot_username(me.username or "")
         logger.info("Bot username: @%s", handlers.BOT_USERNAME)
         infra_logger.info("Bot username: @%s", handlers.BOT_USERNAME)
 
@@ -68,17 +85,39 @@ def main() -> None:
         ]
         for name, desc in ALL_COMMANDS:
             bot_commands.append(BotCommand(name, desc))
-        await bot.set_my_commands(bot_commands)
-        logger.info("Registered %d bot commands with Telegram", len(bot_commands))
+        # The list only changes on deploy; skip the round-trip when the
+        # same bot already has it.
+        commands_hash = hashlib.blake2b(json.dumps(
+            [me.id, [(c.command, c.description) for c in bot_commands]]
+        ).encode()).hexdigest()
+        try:
+            registered_hash = BOT_COMMANDS_HASH_FILE.read_text().strip()
+        except OSError:
+            registered_hash = ""
+        if registered_hash == commands_hash:
+            logger.info("Bot commands unchanged, skipping registration")
+        else:
+            await bot.set_my_commands(bot_commands)
+            logger.info("Registered %d bot commands with Telegram", len(bot_commands))
+            try:
+                tmp = BOT_COMMANDS_HASH_FILE.with_suffix(".tmp")
+                tmp.write_text(commands_hash)
+                os.replace(tmp, BOT_COMMANDS_HASH_FILE)
+            except OSError as e:
+                infra_logger.warning("Failed to save bot commands hash: %s", e)
 
         if HAS_SDK:
             asyncio.create_task(cleanup_idle_sessions())
             logger.info("SDK idle session cleanup task started")
 
+        removed = await asyncio.to_thread(prune_partial_downloads, WORKSPACES_DIR)
+        if removed:
+            infra_logger.info("Removed %d partial download(s) from a previous run", removed)
+
         # Edit "Restarting..." messages to show success
         if RESTART_MESSAGES_FILE.exists():
             try:
-                msgs = json.loads(RESTART_MESSAGES_FILE.read_text())
+                msgs = _json_fast.loads(RESTART_MESSAGES_FILE.read_bytes())
                 for entry in msgs:
                     try:
                         await bot.edit_message_text(
@@ -100,12 +139,16 @@ def main() -> None:
         interrupted: dict[str, dict] = {}
 
         for state_file in (RESTART_STATE_FILE, ACTIVE_STREAMS_FILE):
-            if not state_file.exists():
+            # Open directly rather than probing with exists(): usually absent
+            try:
+                raw = state_file.read_bytes()
+            except FileNotFoundError:
                 continue
+            except OSError:
+                raw = b""
             try:
-                data = json.loads(state_file.read_text())
-                interrupted.update(data)
-            except (json.JSONDecodeError, OSError):
+                interrupted.update(_json_fast.loads(raw))
+            except json.JSONDecodeError:
                 pass
             finally:
                 state_file.unlink(missing_ok=True)
@@ -115,62 +158,81 @@ def main() -> None:
 
         infra_logger.info("Resuming %d interrupted generation(s)", len(interrupted))
 
+        chat_locks: dict[int, asyncio.Lock] = {}
+        resume_slots = asyncio.Semaphore(MAX_CONCURRENT_RESUMES)
+
+        async def _deliver(cid: int, tg_thread_id: int | None, rendered_chunks: Iterable[str]) -> None:
+            for rendered in rendered_chunks:
+                if is_balanced_html(rendered):
+                    try:
+                        await bot.send_message(
+                            chat_id=cid,
+                            text=rendered,
+                            parse_mode="HTML",
+                            disable_web_page_preview=True,
+                            message_thread_id=tg_thread_id,
+                        )
+                        continue
+                    except Exception:
+                        pass
+                plain = strip_tags(rendered)
+                for pc in split_message(plain):
+                    await bot.send_message(
+                        chat_id=cid,
+                        text=pc,
+                        message_thread_id=tg_thread_id,
+                    )
+
         async def _resume_chat(entry: dict) -> None:
             cid = entry["chat_id"]
             tid = entry["thread_id"]
             uid = entry["user_id"]
             try:
-                session_id = get_session_id(cid, tid, uid)
-                if not session_id:
-                    infra_logger.warning(
-                        "No session for chat=%d thread=%d user=%d, skipping resume",
-                        cid, tid, uid,
+                async with resume_slots:
+                    session_id = get_session_id(cid, tid, uid)
+                    if not session_id:
+                        infra_logger.warning(
+                            "No session for chat=%d thread=%d user=%d, skipping resume",
+                            cid, tid, uid,
+                        )
+                        return
+                    resume_msg = (
+                        "[System: The bot just restarted. Continue where you left off "
+                        "and deliver the result to the user.]"
                     )
-                    return
-                resume_msg = (
-                    "[System: The bot just restarted. Continue where you left off "
-                    "and deliver the result to the user.]"
-                )
-                chat_working_dir = get_working_dir(cid)
-                result_text = None
-                async for event in stream_claude(resume_msg, cid, tid, uid,
-                                                 working_dir=chat_working_dir):
-                    if event.get("type") == "result":
-                        result_text = event.get("text", "")
-                    elif event.get("type") == "error":
-                        result_text = event.get("text", "")
-                if result_text:
-                    md_chunks = split_message(result_text)
-                    tg_thread_id = tid or None
-                    for md_chunk in md_chunks:
-                        rendered = renderer.render(md_chunk)
-                        try:
-                            await bot.send_message(
-                                chat_id=cid,
-                                text=rendered,
-                                parse_mode="HTML",
-                                disable_web_page_preview=True,
-                                message_thread_id=tg_thread_id,
-                            )
-                        except Exception:
-                            plain = re.sub(r"<[^>]+>", "", rendered)
-                            for pc in split_message(plain):
-                                await bot.send_message(
-                                    chat_id=cid,
-                                    text=pc,
-                                    message_thread_id=tg_thread_id,
-                                )
-                infra_logger.info("Resumed chat=%d thread=%d user=%d", cid, tid, uid)
+                    chat_working_dir = get_working_dir(cid)
+                    result_text = None
+                    async for event in stream_claude(resume_msg, request_ctx(cid, tid, uid),
+                                                     working_dir=chat_working_dir):
+                        if event.get("type") == "result":
+                            result_text = event.get("text", "")
+                        elif event.get("type") == "error":
+                            result_text = event.get("text", "")
+                    if result_text:
+                        # Lazy: each chunk is split and rendered just before it is sent
+                        rendered_chunks = (
+                            renderer.render(c) for c in iter_split_message(result_text)
+                        )
+                        tg_thread_id = tid or None
+                        # Resumes run concurrently; serialize sends per chat so
+                        # chunks from different threads don't interleave.
+                        async with chat_locks.setdefault(cid, asyncio.Lock()):
+                            await _deliver(cid, tg_thread_id, rendered_chunks)
+                    infra_logger.info("Resumed chat=%d thread=%d user=%d", cid, tid, uid)
             except Exception as e:
                 infra_logger.error(
                     "Failed to resume chat=%d thread=%d user=%d: %s", cid, tid, uid, e
                 )
 
-        await asyncio.gather(*[_resume_chat(e) for e in interrupted.values()])
+        async with asyncio.TaskGroup() as tg:
+            for entry in interrupted.values():
+                tg.create_task(_resume_chat(entry))
         infra_logger.info("Restart recovery complete")
 
     async def post_shutdown(application: Application) -> None:
-        """Clean up SDK sessions on shutdown."""
+        """Clean up SDK sessions and persist pending state on shutdown."""
+        flush_active_streams()
+        flush_sessions()
         if HAS_SDK:
             await shutdown_sdk_sessions()
             infra_logger.info("SDK sessions shut down")
@@ -189,10 +251,10 @@ def main() -> None:
     app.add_handler(CommandHandler("status", handlers.cmd_status))
     register_all(app)
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.handle_message))
-    app.add_handler(MessageHandler(filters.VOICE | filters.AUDIO, handlers.handle_voice))
-    app.add_handler(MessageHandler(filters.VIDEO, handlers.handle_video))
-    app.add_handler(MessageHandler(filters.Document.ALL, handlers.handle_document))
-    app.add_handler(MessageHandler(filters.PHOTO, handlers.handle_photo))
+    app.add_handler(MessageHandler(
+        filters.VOICE | filters.AUDIO | filters.VIDEO | filters.Document.ALL | filters.PHOTO,
+        handlers.handle_media,
+    ))
 
     # Start polling
     logger.info("Bot is running. Press Ctrl+C to stop.")
@@ -1,60 +1,84 @@
 """Claude integration (stream_claude, SDK/subprocess)."""
 
 import asyncio
+import contextlib
+import functools
 import json
 import os
 import shutil
+import time
 from pathlib import Path
 
-from bot.config import (
-    ADMIN_USER_ID, ALL_TOOLS, CLAUDE_MODEL, CLAUDE_TIMEOUT, WORKING_DIR,
-)
+# orjson is optional; both parsers accept bytes and raise json.JSONDecodeError subclasses
+try:
+    import orjson as _json_fast
+except ImportError:
+    _json_fast = json
+
+from bot.config import ALL_TOOLS, CLAUDE_MODEL, CLAUDE_TIMEOUT, WORKING_DIR
 from bot.logging_setup import logger, get_workspace_logger, _summarize_input
-from bot.sessions import session_key, get_session_id, set_session_id
+from bot.sessions import RequestCtx, get_session_id, set_session_id
 from bot.streams import add_active_stream, remove_active_stream
 from bot.permissions import build_env, build_sdk_options
 from bot.sdk_session import (
-    HAS_SDK, SDKSession, sdk_sessions,
+    HAS_SDK, SDKSession, sdk_sessions, mark_active,
     AssistantMessage, ResultMessage, StreamEvent,
     TextBlock, ToolUseBlock, ToolResultBlock,
 )
 
 
+# Status-line prefixes, one per tool family
+_READ = "\U0001f4c4 "
+_SEARCH = "\U0001f50d "
+_RUN = "\u2699\ufe0f "
+_EDIT = "\u270f\ufe0f "
+_WEB = "\U0001f310 "
+_AGENT = "\U0001f916 "
+_OTHER = "\U0001f527 "
+
+
+def _format_bash(tool_input: dict) -> str:
+    cmd = tool_input.get("command", "")
+    if cmd:
+        short_cmd = cmd[:60] + "\u2026" if len(cmd) > 60 else cmd
+        return f"{_RUN}`{short_cmd}`"
+    desc = tool_input.get("description", "")
+    if desc:
+        return f"{_RUN}{desc}"
+    return f"{_RUN}Running command..."
+
+
+def _format_edit(tool_input: dict) -> str:
+    return f"{_EDIT}Editing {Path(tool_input.get('file_path', 'file')).name}..."
+
+
+_TOOL_FORMATTERS = {
+    "Read": lambda ti: f"{_READ}Reading {Path(ti.get('file_path', 'file')).name}...",
+    "Glob": lambda ti: f"{_SEARCH}Searching {ti.get('pattern', '')}...",
+    "Grep": lambda ti: f'{_SEARCH}Searching for "{ti.get("pattern", "")}"...',
+    "Bash": _format_bash,
+    "Write": _format_edit,
+    "Edit": _format_edit,
+    "WebSearch": lambda ti: f"{_WEB}Searching web...",
+    "WebFetch": lambda ti: f"{_WEB}Fetching {ti.get('url', '')[:60]}...",
+    "Task": lambda ti: f"{_AGENT}Delegating to sub-agent...",
+}
+
+
 def format_tool_status(tool_name: str, tool_input: dict) -> str:
     """Format a human-readable status line for an active tool call."""
-    if tool_name == "Read":
-        path = tool_input.get("file_path", "file")
-        return f"\U0001f4c4 Reading {Path(path).name}..."
-    if tool_name == "Glob":
-        pattern = tool_input.get("pattern", "")
-        return f"\U0001f50d Searching {pattern}..."
-    if tool_name == "Grep":
-        pattern = tool_input.get("pattern", "")
-        return f'\U0001f50d Searching for "{pattern}"...'
-    if tool_name == "Bash":
-        cmd = tool_input.get("command", "")
-        if cmd:
-            short_cmd = cmd[:60] + "\u2026" if len(cmd) > 60 else cmd
-            return f"\u2699\ufe0f `{short_cmd}`"
-        desc = tool_input.get("description", "")
-        if desc:
-            return f"\u2699\ufe0f {desc}"
-        return "\u2699\ufe0f Running command..."
-    if tool_name in ("Write", "Edit"):
-        path = tool_input.get("file_path", "file")
-        return f"\u270f\ufe0f Editing {Path(path).name}..."
-    if tool_name == "WebSearch":
-        return "\U0001f310 Searching web..."
-    if tool_name == "WebFetch":
-        url = tool_input.get("url", "")
-        return f"\U0001f310 Fetching {url[:60]}..."
-    if tool_name == "Task":
-        return "\U0001f916 Delegating to sub-agent..."
-    return f"\U0001f527 Using {tool_name}..."
+    fn = _TOOL_FORMATTERS.get(tool_name)
+    return fn(tool_input) if fn else f"{_OTHER}Using {tool_name}..."
+
+
+_PREFIXES = tuple((p, len(p)) for p in (_READ, _SEARCH, _RUN, _EDIT, _WEB, _AGENT, _OTHER))
 
 
 def finished_line(active_line: str) -> str:
     """Convert an active tool status line to a finished (checkmark) line."""
+    for prefix, n in _PREFIXES:
+        if active_line.startswith(prefix):
+            return f"\u2713 {active_line[n:].rstrip('.')}"
     text = active_line
     idx = text.find(" ")
     if idx != -1:
@@ -63,7 +87,44 @@ def finished_line(active_line: str) -> str:
     return f"\u2713 {text}"
 
 
-async def stream_claude(message: str, chat_id: int, thread_id: int, user_id: int,
+# Partial text is released once this many chars or this many seconds have built
+# up. Both are checked as chunks arrive; a held tail goes out with the next
+# non-delta event or when the stream ends.
+_PARTIAL_FLUSH_CHARS = 512
+_PARTIAL_FLUSH_INTERVAL = 0.05
+
+
+class _DeltaBuffer:
+    """Accumulate text_delta chunks and release them as larger partial events."""
+
+    __slots__ = ("parts", "size", "last_flush")
+
+    def __init__(self):
+        self.parts: list[str] = []
+        self.size = 0
+        self.last_flush = time.monotonic()
+
+    def add(self, chunk: str) -> str | None:
+        """Buffer a chunk; return the joined text if it is time to flush."""
+        self.parts.append(chunk)
+        self.size += len(chunk)
+        if (self.size >= _PARTIAL_FLUSH_CHARS
+                or time.monotonic() - self.last_flush >= _PARTIAL_FLUSH_INTERVAL):
+            return self.flush()
+        return None
+
+    def flush(self) -> str | None:
+        """Return and clear any buffered text."""
+        if not self.parts:
+            return None
+        text = "".join(self.parts)
+        self.parts.clear()
+        self.size = 0
+        self.last_flush = time.monotonic()
+        return text
+
+
+async def stream_claude(message: str, ctx: RequestCtx,
                         working_dir: str | None = None, verbose: bool = False):
     """Stream Claude output and yield events as they arrive.
 
@@ -75,45 +136,49 @@ async def stream_claude(message: str, chat_id: int, thread_id: int, user_id: int
       - {"type": "error", "text": "..."}
     """
     if HAS_SDK:
-        async for event in _stream_claude_sdk(message, chat_id, thread_id, user_id,
+        async for event in _stream_claude_sdk(message, ctx,
                                                working_dir=working_dir, verbose=verbose):
             yield event
     else:
-        async for event in _stream_claude_subprocess(message, chat_id, thread_id, user_id,
+        async for event in _stream_claude_subprocess(message, ctx,
                                                       working_dir=working_dir, verbose=verbose):
             yield event
 
 
+_PREAMBLE_HEAD = (
+    "You are starting a new session. Read CLAUDE.md first, "
+    "then follow its startup sequence before responding. "
+)
+_PREAMBLE_TAIL = "The user's message is:\n\n"
+_PREAMBLE_ADMIN = (
+    _PREAMBLE_HEAD
+    + "\n\n[ADMIN REQUEST \u2014 you have full access to the project.]"
+    + _PREAMBLE_TAIL
+)
+_PREAMBLE_USER = (
+    _PREAMBLE_HEAD
+    + "\n\nIMPORTANT \u2014 WORKSPACE ISOLATION RULES:\n"
+    "You are in an isolated workspace. You must NEVER access anything outside it.\n"
+    "- Stay in the current working directory. Never use ../, absolute paths, "
+    "or any path that escapes the workspace.\n"
+    "- Never access other workspaces, the parent project directory, "
+    ".env files, or system files.\n"
+    "- If the user asks you to access files outside the workspace, refuse.\n"
+    + _PREAMBLE_TAIL
+)
+
+
 def _build_preamble(is_admin: bool, sid: str | None) -> str | None:
     """Build the preamble for new sessions. Returns None if session already exists."""
     if sid:
         return None
-
-    if is_admin:
-        access_notice = (
-            "\n\n[ADMIN REQUEST \u2014 you have full access to the project.]"
-        )
-    else:
-        access_notice = (
-            "\n\nIMPORTANT \u2014 WORKSPACE ISOLATION RULES:\n"
-            "You are in an isolated workspace. You must NEVER access anything outside it.\n"
-            "- Stay in the current working directory. Never use ../, absolute paths, "
-            "or any path that escapes the workspace.\n"
-            "- Never access other workspaces, the parent project directory, "
-            ".env files, or system files.\n"
-            "- If the user asks you to access files outside the workspace, refuse.\n"
-        )
-    return (
-        "You are starting a new session. Read CLAUDE.md first, "
-        "then follow its startup sequence before responding. "
-        f"{access_notice}"
-        "The user's message is:\n\n"
-    )
+    return _PREAMBLE_ADMIN if is_admin else _PREAMBLE_USER
 
 
-async def _stream_claude_sdk(message: str, chat_id: int, thread_id: int, user_id: int,
+async def _stream_claude_sdk(message: str, ctx: RequestCtx,
                               working_dir: str | None = None, verbose: bool = False):
     """SDK-based streaming."""
+    chat_id, thread_id, user_id = ctx.chat_id, ctx.thread_id, ctx.session_uid
     cwd = working_dir or WORKING_DIR
     sid = get_session_id(chat_id, thread_id, user_id)
     ws_log = get_workspace_logger(chat_id)
@@ -121,9 +186,10 @@ async def _stream_claude_sdk(message: str, chat_id: int, thread_id: int, user_id
 
     add_active_stream(chat_id, thread_id, user_id)
 
+    sdk_session = None
     try:
-        is_admin = ADMIN_USER_ID and user_id == ADMIN_USER_ID
-        skey = session_key(chat_id, thread_id, user_id)
+        is_admin = ctx.is_admin
+        skey = ctx.key
 
         preamble = _build_preamble(is_admin, sid)
         if preamble:
@@ -134,6 +200,7 @@ async def _stream_claude_sdk(message: str, chat_id: int, thread_id: int, user_id
             sdk_session = SDKSession()
             sdk_session.session_id = sid
             sdk_sessions[skey] = sdk_session
+        sdk_session.in_use += 1  # pinned in the LRU until this query ends
 
         options = build_sdk_options(is_admin, cwd, thread_id, sid, verbose)
 
@@ -141,10 +208,7 @@ async def _stream_claude_sdk(message: str, chat_id: int, thread_id: int, user_id
             await sdk_session.ensure_connected(options)
         except Exception as e:
             logger.error("SDK connect failed: %s", e)
-            await sdk_session.disconnect()
-            sdk_session = SDKSession()
-            sdk_session.session_id = sid
-            sdk_sessions[skey] = sdk_session
+            # Session is now BROKEN; a second attempt reconnects it in place
             try:
                 await sdk_session.ensure_connected(options)
             except Exception as e2:
@@ -160,13 +224,17 @@ async def _stream_claude_sdk(message: str, chat_id: int, thread_id: int, user_id
         result_text = None
         new_session_id = None
 
+        deltas = _DeltaBuffer()
+
         try:
             await sdk_session.client.query(message)
-            sdk_session.last_activity = __import__("time").time()
+            mark_active(skey, sdk_session)
 
             async for msg in sdk_session.client.receive_response():
                 if msg is None:
                     continue
+                if not isinstance(msg, StreamEvent) and (pending := deltas.flush()):
+                    yield {"type": "partial", "text": pending}
                 if isinstance(msg, AssistantMessage):
                     for block in msg.content:
                         if isinstance(block, ToolUseBlock):
@@ -182,8 +250,8 @@ async def _stream_claude_sdk(message: str, chat_id: int, thread_id: int, user_id
                     delta = msg.event.get("delta", {})
                     if delta.get("type") == "text_delta":
                         chunk = delta.get("text", "")
-                        if chunk:
-                            yield {"type": "partial", "text": chunk}
+                        if chunk and (text := deltas.add(chunk)):
+                            yield {"type": "partial", "text": text}
 
                 elif isinstance(msg, ResultMessage):
                     new_session_id = msg.session_id
@@ -195,18 +263,19 @@ async def _stream_claude_sdk(message: str, chat_id: int, thread_id: int, user_id
                     ws_log.info("Result \u2014 session=%s, len=%d", new_session_id, len(result_text))
                     yield {"type": "result", "text": result_text, "session_id": new_session_id}
 
+            if pending := deltas.flush():
+                yield {"type": "partial", "text": pending}
+
         except Exception as e:
             err_str = str(e)
             # SIGTERM during restart — not a real error
             if "exit code -15" in err_str or "exit code: -15" in err_str:
                 logger.info("SDK process killed by SIGTERM (likely bot restart)")
-                await sdk_session.disconnect()
-                sdk_sessions.pop(skey, None)
+                await sdk_session.mark_broken()
                 yield {"type": "silent"}
                 return
             logger.exception("SDK streaming error")
-            await sdk_session.disconnect()
-            sdk_sessions.pop(skey, None)
+            await sdk_session.mark_broken()
             if result_text is None:
                 yield {"type": "error", "text": f"Claude error: {e}"}
             return
@@ -219,30 +288,77 @@ async def _stream_claude_sdk(message: str, chat_id: int, thread_id: int, user_id
         logger.exception("Unexpected error in SDK stream_claude")
         yield {"type": "error", "text": f"Unexpected error: {e}"}
     finally:
+        if sdk_session is not None:
+            sdk_session.in_use -= 1
         remove_active_stream(chat_id, thread_id, user_id)
 
 
-async def _stream_claude_subprocess(message: str, chat_id: int, thread_id: int, user_id: int,
+async def _drain_stderr(stream: asyncio.StreamReader, keep: int = 8192) -> bytes:
+    """Read stderr until EOF so the child never blocks on a full pipe; keep only the tail."""
+    buf = bytearray()
+    while chunk := await stream.read(65536):
+        buf += chunk
+        if len(buf) > keep:
+            del buf[:-keep]
+    return bytes(buf)
+
+
+_READ_CHUNK = 64 * 1024
+
+
+async def _iter_lines(stream: asyncio.StreamReader, deadline: float):
+    """Yield complete lines from stream, reading it in _READ_CHUNK blocks.
+
+    One read usually carries many stream-json events, so this is far fewer
+    awaits than readline(). Raises asyncio.TimeoutError at deadline (monotonic).
+    """
+    buf = bytearray()
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise asyncio.TimeoutError
+        chunk = await asyncio.wait_for(stream.read(_READ_CHUNK), timeout=remaining)
+        if not chunk:
+            if buf:
+                yield bytes(buf)
+            return
+        buf += chunk
+        start = 0
+        while (nl := buf.find(b"\n", start)) >= 0:
+            yield bytes(buf[start:nl])
+            start = nl + 1
+        del buf[:start]
+
+
+@functools.cache
+def _claude_bin() -> str:
+    """Resolve the claude CLI once; the PATH lookup result doesn't change at runtime."""
+    claude_bin = shutil.which("claude") or "/root/.local/bin/claude"
+    logger.debug("Using claude binary: %s (exists: %s)", claude_bin, os.path.isfile(claude_bin))
+    return claude_bin
+
+
+async def _stream_claude_subprocess(message: str, ctx: RequestCtx,
                                      working_dir: str | None = None, verbose: bool = False):
     """Legacy subprocess-based streaming."""
+    chat_id, thread_id, user_id = ctx.chat_id, ctx.thread_id, ctx.session_uid
     cwd = working_dir or WORKING_DIR
     sid = get_session_id(chat_id, thread_id, user_id)
     ws_log = get_workspace_logger(chat_id)
     ws_log.info("Claude invocation (subprocess) \u2014 user=%d, session=%s", user_id, sid or "new")
 
     add_active_stream(chat_id, thread_id, user_id)
+    stderr_task = None
 
     try:
-        is_admin = ADMIN_USER_ID and user_id == ADMIN_USER_ID
+        is_admin = ctx.is_admin
 
         preamble = _build_preamble(is_admin, sid)
         if preamble:
             message = preamble + message
 
-        claude_bin = shutil.which("claude") or "/root/.local/bin/claude"
-        logger.info("Using claude binary: %s (exists: %s)", claude_bin, os.path.isfile(claude_bin))
         cmd = [
-            claude_bin,
+            _claude_bin(),
             "-p", message,
             "--output-format", "stream-json",
             "--verbose",
@@ -274,72 +390,66 @@ async def _stream_claude_subprocess(message: str, chat_id: int, thread_id: int,
             env=env,
             limit=10 * 1024 * 1024,
         )
+        stderr_task = asyncio.create_task(_drain_stderr(proc.stderr))
 
         result_text = None
         new_session_id = None
-        deadline = asyncio.get_event_loop().time() + CLAUDE_TIMEOUT
-
-        while True:
-            remaining = deadline - asyncio.get_event_loop().time()
-            if remaining <= 0:
-                proc.kill()
-                await proc.communicate()
-                logger.error("Claude CLI timed out after %ds for user %d", CLAUDE_TIMEOUT, user_id)
-                yield {"type": "error", "text": "Claude took too long to respond. Try again or /new to start fresh."}
-                return
+        deltas = _DeltaBuffer()
+        deadline = time.monotonic() + CLAUDE_TIMEOUT
 
-            try:
-                line = await asyncio.wait_for(proc.stdout.readline(), timeout=remaining)
-            except asyncio.TimeoutError:
-                proc.kill()
-                await proc.communicate()
-                logger.error("Claude CLI timed out after %ds for user %d", CLAUDE_TIMEOUT, user_id)
-                yield {"type": "error", "text": "Claude took too long to respond. Try again or /new to start fresh."}
-                return
-
-            if not line:
-                break
-
-            decoded = line.decode().strip()
-            if not decoded:
-                continue
-
-            try:
-                event = json.loads(decoded)
-            except json.JSONDecodeError:
-                logger.debug("Non-JSON line from Claude: %s", decoded[:200])
-                continue
-
-            event_type = event.get("type")
-
-            if event_type == "assistant":
-                msg_data = event.get("message", {})
-                content = msg_data.get("content", [])
-                for block in content:
-                    if isinstance(block, dict) and block.get("type") == "tool_use":
-                        tool_name = block.get("name", "")
-                        tool_input = block.get("input", {})
-                        ws_log.info("Tool: %s \u2014 %s", tool_name, _summarize_input(tool_input))
-                        status = format_tool_status(tool_name, tool_input)
-                        yield {"type": "tool_use", "status": status}
-            elif event_type == "tool_result":
-                yield {"type": "tool_result"}
-
-            elif event_type == "stream_event" and verbose:
-                delta = event.get("event", {}).get("delta", {})
-                if delta.get("type") == "text_delta":
-                    chunk = delta.get("text", "")
-                    if chunk:
-                        yield {"type": "partial", "text": chunk}
-
-            elif event_type == "result":
-                result_text = event.get("result", "")
-                new_session_id = event.get("session_id")
-                if new_session_id:
-                    set_session_id(chat_id, thread_id, user_id, new_session_id)
-                    logger.info("Session updated for user %d: %s", user_id, new_session_id)
-                ws_log.info("Result \u2014 session=%s, len=%d", new_session_id, len(result_text or ""))
-                yield {"type": "result", "text": result_text, "session_id": new_session_id}
+        try:
+            async with contextlib.aclosing(_iter_lines(proc.stdout, deadline)) as lines:
+                async for line in lines:
+                    if not line or line.isspace():
+                        continue
+
+                    try:
+                        event = _json_fast.loads(line)
+                    except json.JSONDecodeError:
+                        logger.debug("Non-JSON line from Claude: %s", line[:200])
+                        continue
+
+                    event_type = event.get("type")
+
+                    if event_type != "stream_event" and (pending := deltas.flush()):
+                        yield {"type": "partial", "text": pending}
+
+                    if event_type == "assistant":
+                        msg_data = event.get("message", {})
+                        content = msg_data.get("content", [])
+                        for block in content:
+                            if isinstance(block, dict) and block.get("type") == "tool_use":
+                                tool_name = block.get("name", "")
+                                tool_input = block.get("input", {})
+                                ws_log.info("Tool: %s \u2014 %s", tool_name, _summarize_input(tool_input))
+                                status = format_tool_status(tool_name, tool_input)
+                                yield {"type": "tool_use", "status": status}
+                    elif event_type == "tool_result":
+                        yield {"type": "tool_result"}
+
+                    elif event_type == "stream_event" and verbose:
+                        delta = event.get("event", {}).get("delta", {})
+                        if delta.get("type") == "text_delta":
+                            chunk = delta.get("text", "")
+                            if chunk and (text := deltas.add(chunk)):
+                                yield {"type": "partial", "text": text}
+
+                    elif event_type == "result":
+                        result_text = event.get("result", "")
+                        new_session_id = event.get("session_id")
+                        if new_session_id:
+                            set_session_id(chat_id, thread_id, user_id, new_session_id)
+                            logger.info("Session updated for user %d: %s", user_id, new_session_id)
+                        ws_log.info("Result \u2014 session=%s, len=%d", new_session_id, len(result_text or ""))
+                        yield {"type": "result", "text": result_text, "session_id": new_session_id}
+            if pending := deltas.flush():
+                yield {"type": "partial", "text": pending}
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            logger.error("Claude CLI timed out after %ds for user %d", CLAUDE_TIMEOUT, user_id)
+            yield {"type": "error", "text": "Claude took too long to respond. Try again or /new to start fresh."}
+            return
 
         await proc.wait()
 
@@ -350,8 +460,8 @@ async def _stream_claude_subprocess(message: str, chat_id: int, thread_id: int,
                 if result_text is None:
                     yield {"type": "silent"}
                 return
-            stderr_data = await proc.stderr.read()
-            error_msg = stderr_data.decode().strip() if stderr_data else "Unknown error"
+            stderr_data = await stderr_task
+            error_msg = stderr_data.decode(errors="replace").strip() if stderr_data else "Unknown error"
             logger.error("Claude CLI error (rc=%d): %s", proc.returncode, error_msg)
             ws_log.error("CLI error rc=%d: %s", proc.returncode, error_msg[:200])
             if result_text is None:
@@ -373,4 +483,6 @@ async def _stream_claude_subprocess(message: str, chat_id: int, thread_id: int,
         logger.exception("Unexpected error streaming Claude")
         yield {"type": "error", "text": f"Unexpected error: {e}"}
     finally:
+        if stderr_task and not stderr_task.done():
+            stderr_task.cancel()
         remove_active_stream(chat_id, thread_id, user_id)
@@ -18,14 +18,14 @@ WORKING_DIR = os.getenv("WORKING_DIR") or str(SCRIPT_DIR)
 WORKSPACES_DIR = SCRIPT_DIR / "workspaces"
 
 # Parse allowed users (first entry is admin)
-ALLOWED_USERS: set[int] = set()
 ALLOWED_USERS_LIST: list[int] = []
 if ALLOWED_USERS_RAW.strip():
     for uid in ALLOWED_USERS_RAW.split(","):
         uid = uid.strip()
         if uid.isdigit():
-            ALLOWED_USERS.add(int(uid))
             ALLOWED_USERS_LIST.append(int(uid))
+# Immutable after startup; checked on every update
+ALLOWED_USERS: frozenset[int] = frozenset(ALLOWED_USERS_LIST)
 
 ADMIN_USER_ID: int | None = ALLOWED_USERS_LIST[0] if ALLOWED_USERS_LIST else None
 
@@ -50,6 +50,9 @@ RESTART_STATE_FILE = SCRIPT_DIR / ".restart-state.json"
 # Restart notification messages (for editing after outcome)
 RESTART_MESSAGES_FILE = SCRIPT_DIR / ".restart-messages.json"
 
+# Hash of the last command list registered with Telegram
+BOT_COMMANDS_HASH_FILE = SCRIPT_DIR / ".bot-commands.hash"
+
 # Minimum interval between Telegram message edits (seconds)
 STATUS_EDIT_INTERVAL = 1.5
 
@@ -59,6 +62,9 @@ BATCH_WINDOW = 1.5
 # SDK idle timeout (seconds)
 SDK_IDLE_TIMEOUT = 300
 
+# Upper bound on per-user / per-session in-memory registries (LRU-evicted)
+MAX_TRACKED_SESSIONS = 1024
+
 # Logs directory
 LOGS_DIR = SCRIPT_DIR / "logs"
 
@@ -76,8 +82,6 @@ def set_claude_model(model: str) -> None:
 
 def is_authorized(user_id: int) -> bool:
     """Check if a user is authorized to use the bot."""
-    if not ALLOWED_USERS:
-        return False
     return user_id in ALLOWED_USERS
 
 
@@ -0,0 +1,136 @@
+"""Media downloads from the Telegram Bot API."""
+
+import asyncio
+import os
+from pathlib import Path
+from urllib.parse import quote, urlsplit, urlunsplit
+
+import httpx
+
+from bot.logging_setup import logger
+
+# Files at least this large are fetched as parallel byte ranges
+PARALLEL_MIN_SIZE = 4 * 1024 * 1024
+PARALLEL_PARTS = 4
+# Range bodies are written out in pieces of this size as they arrive
+RANGE_CHUNK = 256 * 1024
+
+PART_SUFFIX = ".part"
+
+# Caps in-flight range requests across all downloads to avoid flood limits
+_range_slots = asyncio.Semaphore(8)
+
+# Caps concurrent file downloads across all handlers so album bursts don't
+# hold an unbounded number of sockets and buffers at once
+MAX_CONCURRENT_DOWNLOADS = 4
+_download_slots = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+
+
+async def download_file(file, dest: Path) -> None:
+    """Download a telegram.File to dest without blocking the event loop.
+
+    Large remote files are fetched as PARALLEL_PARTS concurrent HTTP range
+    requests written straight to their offsets; anything else, or any range
+    failure, falls back to a single in-memory fetch. At most
+    MAX_CONCURRENT_DOWNLOADS run at a time; the rest wait their turn.
+    """
+    async with _download_slots:
+        try:
+            await _download(file, dest)
+        except FileNotFoundError:
+            # Parent was deleted behind workspaces.ensure_dir's cache; recreate once
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            await _download(file, dest)
+
+
+async def _download(file, dest: Path) -> None:
+    # Write next to dest and rename on success, so a crash never leaves a
+    # truncated file under the real name (leftovers: prune_partial_downloads)
+    part = dest.with_name(dest.name + PART_SUFFIX)
+    try:
+        await _download_to(file, part)
+        os.replace(part, dest)
+    except BaseException:
+        part.unlink(missing_ok=True)
+        raise
+
+
+async def _download_to(file, dest: Path) -> None:
+    size = file.file_size or 0
+    url = str(file.file_path or "")
+    if size >= PARALLEL_MIN_SIZE and url.startswith(("http://", "https://")):
+        try:
+            await _download_ranges(_encode_url(url), dest, size)
+            return
+        except Exception as e:
+            logger.warning("Parallel download of %s failed, retrying as one stream: %s",
+                           dest.name, e)
+    buf = await file.download_as_bytearray()
+    await asyncio.to_thread(dest.write_bytes, buf)
+
+
+def prune_partial_downloads(root: Path) -> int:
+    """Delete *.part files left under root by downloads cut short by a crash."""
+    removed = 0
+    for part in root.glob(f"*/uploads/**/*{PART_SUFFIX}"):
+        try:
+            part.unlink()
+            removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+def _encode_url(url: str) -> str:
+    parts = urlsplit(url)
+    return urlunsplit(parts._replace(path=quote(parts.path)))
+
+
+async def _download_ranges(url: str, dest: Path, size: int) -> None:
+    part = -(-size // PARALLEL_PARTS)
+    ranges = [(lo, min(lo + part, size) - 1) for lo in range(0, size, part)]
+
+    fd = os.open(dest, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        if hasattr(os, "posix_fallocate"):
+            os.posix_fallocate(fd, 0, size)
+
+        async def write(chunk: bytes, offset: int) -> None:
+            # A cancelled to_thread await leaves the thread running; wait it out
+            # so no pwrite can reach fd after it is closed (or reused)
+            w = asyncio.ensure_future(asyncio.to_thread(os.pwrite, fd, chunk, offset))
+            try:
+                await asyncio.shield(w)
+            except asyncio.CancelledError:
+                await asyncio.wait({w})
+                raise
+
+        async with httpx.AsyncClient(timeout=60) as client:
+            async def fetch(lo: int, hi: int) -> None:
+                # Stream the range to its offset so at most one chunk per
+                # range is held in memory, instead of the whole range body
+                end = hi + 1
+                async with _range_slots:
+                    async with client.stream(
+                        "GET", url, headers={"Range": f"bytes={lo}-{hi}"}
+                    ) as resp:
+                        if resp.status_code != 206:
+                            raise RuntimeError(
+                                f"range {lo}-{hi} not honoured (HTTP {resp.status_code})"
+                            )
+                        offset = lo
+                        async for chunk in resp.aiter_bytes(RANGE_CHUNK):
+                            if offset + len(chunk) > end:
+                                break
+                            await write(chunk, offset)
+                            offset += len(chunk)
+                if offset != end:
+                    raise RuntimeError(f"range {lo}-{hi} returned the wrong length")
+
+            # A failing range cancels its siblings, and all of them have
+            # finished before fd is closed below
+            async with asyncio.TaskGroup() as tg:
+                for lo, hi in ranges:
+                    tg.create_task(fetch(lo, hi))
+    finally:
+        os.close(fd)
@@ -3,7 +3,9 @@
 import asyncio
 import html
 import re
-from datetime import datetime
+import time
+from dataclasses import dataclass
+from datetime import date, datetime, time as dtime, timedelta
 from pathlib import Path
 
 from telegram import Update
@@ -11,24 +13,33 @@ from telegram.constants import ParseMode
 from telegram.ext import ContextTypes
 
 from bot.config import (
-    ADMIN_USER_ID, ALL_TOOLS, BATCH_WINDOW, STATUS_EDIT_INTERVAL,
+    ADMIN_USER_ID, ALL_TOOLS, BATCH_WINDOW, MAX_TRACKED_SESSIONS, STATUS_EDIT_INTERVAL,
     TELEGRAM_MAX_LENGTH, is_authorized,
     get_thread_id,
 )
 from bot.logging_setup import logger, get_workspace_logger
-from bot.sessions import session_key, get_session_id, load_sessions, clear_session
-from bot.workspaces import ensure_workspace, get_working_dir
-from bot.renderer import TelegramRenderer, split_message
+from bot.lru import LRUDict
+from bot.sessions import (
+    RequestCtx, request_ctx, load_sessions, clear_session,
+    format_updated_at,
+)
+from bot.workspaces import ensure_dir, ensure_workspace, get_working_dir, upload_dir
+from bot.downloads import download_file
+from bot.renderer import TelegramRenderer, is_balanced_html, split_message, strip_tags
 from bot.claude import stream_claude, finished_line, format_tool_status
 from bot.sdk_session import sdk_sessions, SDKSession
 
-# Populated at startup via post_init callback
+# Populated at startup via set_bot_username() from the post_init callback
 BOT_USERNAME: str = ""
+_bot_username_lower = ""
+_bot_mention_lower = ""
+_mention_re: re.Pattern | None = None
 
 renderer = TelegramRenderer()
 
-# Per-user locks to prevent concurrent Claude calls for the same user
-_user_locks: dict[int, asyncio.Lock] = {}
+# Per-user locks to prevent concurrent Claude calls for the same user.
+# Bounded LRU; a lock that is currently held is never evicted.
+_user_locks: LRUDict = LRUDict(MAX_TRACKED_SESSIONS, pinned=lambda lock: lock.locked())
 
 
 def _get_user_lock(user_id: int) -> asyncio.Lock:
@@ -41,6 +52,25 @@ def _get_user_lock(user_id: int) -> asyncio.Lock:
 # Group / Topic Helpers
 # ---------------------------------------------------------------------------
 
+def ctx_from_update(update: Update) -> RequestCtx:
+    """Build the RequestCtx for the sender of this update."""
+    return request_ctx(
+        update.effective_chat.id,
+        get_thread_id(update),
+        update.effective_user.id,
+        private=update.effective_chat.type == "private",
+    )
+
+
+def set_bot_username(username: str) -> None:
+    """Record the bot's username and precompute the mention matchers."""
+    global BOT_USERNAME, _bot_username_lower, _bot_mention_lower, _mention_re
+    BOT_USERNAME = username
+    _bot_username_lower = username.lower()
+    _bot_mention_lower = f"@{_bot_username_lower}"
+    _mention_re = re.compile(rf"@{re.escape(username)}\b", re.IGNORECASE) if username else None
+
+
 def should_respond(update: Update) -> bool:
     """Decide whether the bot should respond to this message."""
     chat = update.effective_chat
@@ -51,32 +81,32 @@ def should_respond(update: Update) -> bool:
     if not msg:
         return False
 
-    thread_id = get_thread_id(update)
-    from commands.config import get_respond_mode
-    mode = get_respond_mode(chat.id, thread_id)
-
-    if mode == "all":
-        return True
-
+    # Mention/reply checks are attribute reads; the respond mode needs a
+    # settings lookup, so it goes last.
     if msg.entities:
+        text = msg.text
+        mention_len = len(_bot_mention_lower)
         for entity in msg.entities:
-            if entity.type == "mention":
-                mention = msg.text[entity.offset:entity.offset + entity.length]
-                if mention.lower() == f"@{BOT_USERNAME.lower()}":
+            # Compare lengths first so other users' mentions aren't sliced/lowered
+            if entity.type == "mention" and entity.length == mention_len:
+                mention = text[entity.offset:entity.offset + mention_len]
+                if mention.lower() == _bot_mention_lower:
                     return True
 
-    if msg.reply_to_message and msg.reply_to_message.from_user:
-        if msg.reply_to_message.from_user.username and \
-           msg.reply_to_message.from_user.username.lower() == BOT_USERNAME.lower():
+    reply = msg.reply_to_message
+    if reply and reply.from_user:
+        username = reply.from_user.username
+        if username and username.lower() == _bot_username_lower:
             return True
 
-    return False
+    from commands.config import get_respond_mode
+    return get_respond_mode(chat.id, get_thread_id(update)) == "all"
 
 
 def strip_bot_mention(text: str) -> str:
     """Remove @bot_username from message text."""
-    if BOT_USERNAME:
-        text = re.sub(rf"@{re.escape(BOT_USERNAME)}\b", "", text, flags=re.IGNORECASE).strip()
+    if _mention_re is not None:
+        text = _mention_re.sub("", text).strip()
     return text
 
 
@@ -91,26 +121,28 @@ async def send_rendered(
 ) -> None:
     """Render markdown to HTML and send, splitting if needed."""
     md_chunks = split_message(text)
-    thread_id = get_thread_id(update)
+    tg_thread_id = get_thread_id(update) or None
 
     for md_chunk in md_chunks:
         chunk = renderer.render(md_chunk)
-        try:
-            await update.message.reply_text(
-                chunk,
-                parse_mode=ParseMode.HTML,
-                disable_web_page_preview=True,
-                message_thread_id=thread_id or None,
-            )
-        except Exception:
-            logger.warning("HTML send failed for chunk, falling back to plain text")
-            plain = re.sub(r"<[^>]+>", "", chunk)
-            plain_chunks = split_message(plain)
-            for pc in plain_chunks:
+        if is_balanced_html(chunk):
+            try:
                 await update.message.reply_text(
-                    pc,
-                    message_thread_id=thread_id or None,
+                    chunk,
+                    parse_mode=ParseMode.HTML,
+                    disable_web_page_preview=True,
+                    message_thread_id=tg_thread_id,
                 )
+                continue
+            except Exception:
+                logger.warning("HTML send failed for chunk, falling back to plain text")
+        plain = strip_tags(chunk)
+        plain_chunks = split_message(plain)
+        for pc in plain_chunks:
+            await update.message.reply_text(
+                pc,
+                message_thread_id=tg_thread_id,
+            )
 
 
 # ---------------------------------------------------------------------------
@@ -149,17 +181,15 @@ async def cmd_new(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not is_authorized(user.id):
         return
 
-    chat_id = update.effective_chat.id
-    thread_id = get_thread_id(update)
-    session_uid = user.id if update.effective_chat.type == "private" else 0
+    ctx = ctx_from_update(update)
+    chat_id, thread_id = ctx.chat_id, ctx.thread_id
 
     # Disconnect SDK session if active
-    sdk_key = session_key(chat_id, thread_id, session_uid)
-    sdk_session = sdk_sessions.pop(sdk_key, None)
+    sdk_session = sdk_sessions.pop(ctx.key, None)
     if sdk_session:
         await sdk_session.disconnect()
 
-    clear_session(chat_id, thread_id, session_uid)
+    clear_session(chat_id, thread_id, ctx.session_uid)
     await update.message.reply_text(
         "Session cleared. Starting fresh.",
         message_thread_id=thread_id or None,
@@ -174,34 +204,29 @@ async def cmd_status(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
         await update.message.reply_text(f"Your Telegram user ID: {user.id}")
         return
 
-    chat_id = update.effective_chat.id
-    thread_id = get_thread_id(update)
-    session_uid = user.id if update.effective_chat.type == "private" else 0
-    sid = get_session_id(chat_id, thread_id, session_uid)
-    sessions = load_sessions()
-    key = session_key(chat_id, thread_id, session_uid)
-    user_data = sessions.get(key, {})
-
-    status_lines = [
-        f"<b>OpenClaude Status</b>",
-        f"",
-        f"<b>User ID:</b> <code>{user.id}</code>",
-        f"<b>Username:</b> @{html.escape(user.username) if user.username else 'N/A'}",
-        f"<b>Session:</b> <code>{sid or 'None'}</code>",
-    ]
-
+    ctx = ctx_from_update(update)
+    chat_id, thread_id = ctx.chat_id, ctx.thread_id
+    user_data = load_sessions().get(ctx.key, {})
+    sid = user_data.get("session_id")
+
+    username = html.escape(user.username) if user.username else "N/A"
+    status = (
+        "<b>OpenClaude Status</b>\n"
+        "\n"
+        f"<b>User ID:</b> <code>{user.id}</code>\n"
+        f"<b>Username:</b> @{username}\n"
+        f"<b>Session:</b> <code>{sid or 'None'}</code>\n"
+    )
     if updated := user_data.get("updated_at"):
-        status_lines.append(f"<b>Last active:</b> {updated}")
-
-    chat_dir = get_working_dir(chat_id)
-    status_lines.extend([
-        f"",
-        f"<b>Working dir:</b> <code>{chat_dir}</code>",
-        f"<b>Allowed tools:</b> {ALL_TOOLS}",
-    ])
+        status += f"<b>Last active:</b> {format_updated_at(updated)}\n"
+    status += (
+        "\n"
+        f"<b>Working dir:</b> <code>{get_working_dir(chat_id)}</code>\n"
+        f"<b>Allowed tools:</b> {ALL_TOOLS}"
+    )
 
     await update.message.reply_text(
-        "\n".join(status_lines),
+        status,
         parse_mode=ParseMode.HTML,
         message_thread_id=thread_id or None,
     )
@@ -211,164 +236,254 @@ async def cmd_status(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
 # Message Batching
 # ---------------------------------------------------------------------------
 
-_batch_buffers: dict[str, list[str]] = {}
-_batch_timers: dict[str, asyncio.TimerHandle] = {}
-_batch_updates: dict[str, tuple[Update, ContextTypes.DEFAULT_TYPE]] = {}
-_batch_meta: dict[str, tuple[int, int, int]] = {}
+@dataclass(slots=True)
+class _BatchState:
+    """Pending messages for one session key, flushed after BATCH_WINDOW of quiet.
+
+    Album items and voice notes are queued as tasks that resolve to their message.
+    """
+    buffer: list[str | asyncio.Task]
+    timer: asyncio.TimerHandle | None
+    update_ctx: tuple[Update, ContextTypes.DEFAULT_TYPE]
+    req: RequestCtx
+
+
+_batches: dict[str, _BatchState] = {}
+# Session key -> future resolved when that key's latest flush has finished
+_flush_tails: dict[str, asyncio.Future] = {}
 
 
 async def queue_message(update: Update, context: ContextTypes.DEFAULT_TYPE,
-                        chat_id: int, thread_id: int, user_id: int,
-                        claude_message: str) -> None:
+                        ctx: RequestCtx, claude_message: str | asyncio.Task) -> None:
     """Add a message to the batch buffer. After BATCH_WINDOW seconds of quiet, flush all."""
-    session_user_id = user_id if update.effective_chat.type == "private" else 0
-    key = session_key(chat_id, thread_id, session_user_id)
+    key = ctx.key
 
-    _batch_buffers.setdefault(key, []).append(claude_message)
-    _batch_updates[key] = (update, context)
-    _batch_meta[key] = (chat_id, thread_id, user_id)
+    state = _batches.get(key)
+    if state is None:
+        state = _batches[key] = _BatchState(
+            buffer=[], timer=None, update_ctx=(update, context), req=ctx,
+        )
+    state.buffer.append(claude_message)
+    state.update_ctx = (update, context)
+    state.req = ctx
 
-    if key in _batch_timers:
-        _batch_timers[key].cancel()
+    if state.timer is not None:
+        state.timer.cancel()
 
-    loop = asyncio.get_event_loop()
-    _batch_timers[key] = loop.call_later(
-        BATCH_WINDOW,
-        lambda k=key: asyncio.ensure_future(_flush_batch(k)),
-    )
+    state.timer = asyncio.get_running_loop().call_later(BATCH_WINDOW, _schedule_flush, key)
+
+
+def _schedule_flush(key: str) -> None:
+    """Timer callback: start the flush for a batch whose window has elapsed."""
+    asyncio.create_task(_flush_batch(key))
 
 
 async def _flush_batch(key: str) -> None:
-    """Flush the batch buffer — combine messages and send to Claude."""
-    messages = _batch_buffers.pop(key, [])
-    update_ctx = _batch_updates.pop(key, None)
-    meta = _batch_meta.pop(key, None)
-    _batch_timers.pop(key, None)
+    """Flush the batch buffer — combine messages and send to Claude.
 
-    if not messages or not update_ctx or not meta:
+    Flushes for one key reach Claude in the order their batches closed, even
+    when an earlier batch is still waiting on a download or transcription.
+    """
+    state = _batches.pop(key, None)
+    if state is None or not state.buffer:
         return
 
-    update, context = update_ctx
-    chat_id, thread_id, user_id = meta
+    prev = _flush_tails.get(key)
+    done = asyncio.get_running_loop().create_future()
+    _flush_tails[key] = done
+    try:
+        if prev is not None:
+            await asyncio.shield(prev)
+        await _send_batch(state)
+    finally:
+        done.set_result(None)
+        if _flush_tails.get(key) is done:
+            del _flush_tails[key]
+
+
+async def _send_batch(state: _BatchState) -> None:
+    update, context = state.update_ctx
+    pending = [m for m in state.buffer if isinstance(m, asyncio.Task)]
+    if pending:
+        await asyncio.wait(pending)
+    messages = []
+    failed = 0
+    for m in state.buffer:
+        if isinstance(m, asyncio.Task):
+            if m.cancelled() or m.exception() is not None:
+                logger.error("Queued media failed: %s", None if m.cancelled() else m.exception())
+                failed += 1
+                continue
+            m = m.result()
+        messages.append(m)
+    if not messages:
+        if failed:
+            # Nothing left to send to Claude; don't leave the user without a reply
+            await update.message.reply_text(
+                "[Download failed]", message_thread_id=state.req.thread_id or None,
+            )
+        return
 
     if len(messages) == 1:
         combined = messages[0]
     else:
         combined = "\n\n".join(messages)
 
-    await run_with_streaming(update, context, chat_id, thread_id, user_id, combined)
+    await run_with_streaming(update, context, state.req, combined)
 
 
 # ---------------------------------------------------------------------------
 # Streaming UI
 # ---------------------------------------------------------------------------
 
+LIVE_EDIT_INTERVAL = 2.0
+
+
+class _EditCoalescer:
+    """Background writer that keeps one Telegram message in sync with the latest text.
+
+    Producers call set() and never wait on Telegram. The writer sends only the
+    newest text, at most once per interval, so bursts collapse into one edit.
+    Text identical to what is already shown is skipped without an API call.
+    """
+
+    def __init__(self, update: Update, thread_id: int | None, interval: float,
+                 disable_notification: bool = False):
+        self.update = update
+        self.thread_id = thread_id
+        self.interval = interval
+        self.disable_notification = disable_notification
+        self.msg = None
+        self.latest_text = ""
+        self.sent_text = ""
+        self.dirty = asyncio.Event()
+        self._closed = asyncio.Event()
+        self._task = asyncio.create_task(self.run())
+
+    def set(self, text: str) -> None:
+        self.latest_text = text
+        self.dirty.set()
+
+    async def run(self) -> None:
+        while True:
+            await self.dirty.wait()
+            if self._closed.is_set():
+                return
+            self.dirty.clear()
+            text = self.latest_text
+            if text == self.sent_text:
+                continue
+            try:
+                if self.msg is None:
+                    self.msg = await self.update.message.reply_text(
+                        text,
+                        message_thread_id=self.thread_id,
+                        disable_notification=self.disable_notification,
+                    )
+                else:
+                    await self.msg.edit_text(text)
+                self.sent_text = text
+            except Exception:
+                pass
+            try:
+                await asyncio.wait_for(self._closed.wait(), timeout=self.interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+
+    async def aclose(self) -> None:
+        """Stop the writer, letting an in-flight send finish so msg stays accurate."""
+        self._closed.set()
+        self.dirty.set()
+        await self._task
+
+
 async def run_with_streaming(update: Update, context: ContextTypes.DEFAULT_TYPE,
-                             chat_id: int, thread_id: int, user_id: int,
-                             claude_message: str) -> None:
+                             ctx: RequestCtx, claude_message: str) -> None:
     """Stream Claude output, show tool progress, then send final response."""
-    session_user_id = user_id if update.effective_chat.type == "private" else 0
+    chat_id, thread_id = ctx.chat_id, ctx.thread_id
     tg_thread_id = thread_id or None
     from commands.config import get_streaming, get_verbose
     streaming = get_streaming(chat_id, thread_id)
     show_tools = get_verbose(chat_id, thread_id)
-    status_msg = None
-    finished_lines: list[str] = []
+    # Finished tool lines, already joined with a trailing newline each
+    finished_prefix: str = ""
     current_active: str = ""
-    last_edit_time: float = 0
+    # Live text is kept as parts; only the first live_cap chars are ever displayed
+    live_parts: list[str] = []
+    live_len = 0
+    live_cap = TELEGRAM_MAX_LENGTH - 20
 
-    live_msg = None
-    live_text = ""
-    last_live_edit: float = 0
-    LIVE_EDIT_INTERVAL = 2.0
+    def _finish_active() -> None:
+        nonlocal finished_prefix
+        finished_prefix += finished_line(current_active) + "\n"
 
-    async def _update_status(new_active: str = "") -> None:
-        nonlocal status_msg, current_active, last_edit_time
+    def _update_status(new_active: str = "") -> None:
+        nonlocal current_active
         current_active = new_active
-        lines = list(finished_lines)
-        if current_active:
-            lines.append(current_active)
-        if not lines:
-            return
-
-        text = "\n".join(lines)
-
-        now = asyncio.get_event_loop().time()
-        if status_msg and (now - last_edit_time) < STATUS_EDIT_INTERVAL:
-            return
-
-        try:
-            if status_msg is None:
-                status_msg = await update.message.reply_text(
-                    text,
-                    message_thread_id=tg_thread_id,
-                )
-            else:
-                await status_msg.edit_text(text)
-            last_edit_time = asyncio.get_event_loop().time()
-        except Exception:
-            pass
-
-    async def _update_live(text: str) -> None:
-        nonlocal live_msg, last_live_edit
-
-        now = asyncio.get_event_loop().time()
-        if live_msg and (now - last_live_edit) < LIVE_EDIT_INTERVAL:
+        text = finished_prefix + current_active if current_active else finished_prefix.rstrip("\n")
+        if not text:
             return
+        status_writer.set(text)
 
-        display = text[:TELEGRAM_MAX_LENGTH - 20] + " \u270d\ufe0f" if text else ""
+    def _update_live(text: str) -> None:
+        display = text[:live_cap] + " \u270d\ufe0f" if text else ""
         if not display:
             return
-
-        try:
-            if live_msg is None:
-                live_msg = await update.message.reply_text(
-                    display,
-                    message_thread_id=tg_thread_id,
-                )
-            else:
-                await live_msg.edit_text(display)
-            last_live_edit = asyncio.get_event_loop().time()
-        except Exception:
-            pass
+        live_writer.set(display)
 
     response_text = None
     chat_working_dir = get_working_dir(chat_id)
     in_tool = False
 
-    async with _get_user_lock(session_user_id):
-        async for event in stream_claude(claude_message, chat_id, thread_id, session_user_id,
-                                         working_dir=chat_working_dir, verbose=streaming):
-            etype = event.get("type")
-
-            if etype == "tool_use":
-                in_tool = True
-                live_text = ""
-                if show_tools:
-                    if current_active:
-                        finished_lines.append(finished_line(current_active))
-                    await _update_status(event["status"])
-
-            elif etype == "tool_result":
-                in_tool = False
-                if show_tools:
-                    if current_active:
-                        finished_lines.append(finished_line(current_active))
-                        await _update_status("")
-
-            elif etype == "partial":
-                if not in_tool:
-                    live_text += event["text"]
-                    await _update_live(live_text)
-
-            elif etype == "result":
-                response_text = event.get("text", "")
-
-            elif etype == "error":
-                response_text = event.get("text", "An error occurred.")
+    # Each writer starts a task; nothing may raise between here and the try
+    status_writer = _EditCoalescer(update, tg_thread_id, STATUS_EDIT_INTERVAL,
+                                   disable_notification=True)
+    live_writer = _EditCoalescer(update, tg_thread_id, LIVE_EDIT_INTERVAL)
+    try:
+        async with _get_user_lock(ctx.session_uid):
+            async for event in stream_claude(claude_message, ctx,
+                                             working_dir=chat_working_dir, verbose=streaming):
+                etype = event.get("type")
+
+                if etype == "tool_use":
+                    in_tool = True
+                    live_parts.clear()
+                    live_len = 0
+                    if show_tools:
+                        if current_active:
+                            _finish_active()
+                        _update_status(event["status"])
+
+                elif etype == "tool_result":
+                    in_tool = False
+                    if show_tools:
+                        if current_active:
+                            _finish_active()
+                            _update_status("")
+
+                elif etype == "partial":
+                    if not in_tool and live_len < live_cap:
+                        live_parts.append(event["text"])
+                        live_len += len(event["text"])
+                        _update_live("".join(live_parts))
+
+                elif etype == "result":
+                    response_text = event.get("text", "")
+
+                elif etype == "error":
+                    response_text = event.get("text", "An error occurred.")
+
+                elif etype == "silent":
+                    response_text = ""
+    finally:
+        try:
+            await status_writer.aclose()
+        finally:
+            await live_writer.aclose()
 
-            elif etype == "silent":
-                response_text = ""
+    status_msg = status_writer.msg
+    live_msg = live_writer.msg
 
     # Clean up status message
     if status_msg:
@@ -392,7 +507,7 @@ async def run_with_streaming(update: Update, context: ContextTypes.DEFAULT_TYPE,
     if live_msg and streaming:
         try:
             rendered = renderer.render(response_text)
-            if len(rendered) <= TELEGRAM_MAX_LENGTH:
+            if len(rendered) <= TELEGRAM_MAX_LENGTH and is_balanced_html(rendered):
                 await live_msg.edit_text(
                     rendered,
                     parse_mode=ParseMode.HTML,
@@ -415,6 +530,30 @@ async def run_with_streaming(update: Update, context: ContextTypes.DEFAULT_TYPE,
 # Message & Media Handlers
 # ---------------------------------------------------------------------------
 
+# Upload folders are named by local date; cache the string until midnight.
+_today_str_cache = ""
+_today_expires = 0.0
+
+
+def _today_str() -> str:
+    global _today_str_cache, _today_expires
+    now = time.time()
+    if now >= _today_expires:
+        today = date.today()
+        _today_str_cache = today.isoformat()
+        _today_expires = datetime.combine(today + timedelta(days=1), dtime.min).timestamp()
+    return _today_str_cache
+
+
+def _safe_name(file_name: str | None, fallback: str) -> str:
+    """Strip directories (either separator), NULs and leading dots from an upload name."""
+    if file_name:
+        name = file_name.rsplit("/", 1)[-1].rsplit("\\", 1)[-1].replace("\0", "").lstrip(".")
+        if name:
+            return name
+    return fallback
+
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle incoming text messages — route to Claude."""
     user = update.effective_user
@@ -432,8 +571,8 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     if not message_text:
         return
 
-    chat_id = update.effective_chat.id
-    thread_id = get_thread_id(update)
+    ctx = ctx_from_update(update)
+    chat_id, thread_id = ctx.chat_id, ctx.thread_id
 
     logger.info(
         "Message from %s (%d) in chat %d thread %d, length=%d",
@@ -445,7 +584,28 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         user.id, user.username or user.first_name, len(message_text),
     )
 
-    await queue_message(update, context, chat_id, thread_id, user.id, message_text)
+    await queue_message(update, context, ctx, message_text)
+
+
+async def _download_and_queue(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                               ctx: RequestCtx, file_id: str, dest: Path,
+                               claude_msg: str) -> None:
+    """Download an upload and queue its message.
+
+    Album items arrive as separate updates, handled one after another; their
+    downloads run in the background so the whole album fetches concurrently,
+    and the batch flush waits for them before calling Claude. Messages sent
+    after the album stay behind it (see _flush_batch).
+    """
+    async def fetch() -> str:
+        file = await context.bot.get_file(file_id)
+        await download_file(file, dest)
+        return claude_msg
+
+    if update.message.media_group_id:
+        await queue_message(update, context, ctx, asyncio.create_task(fetch()))
+    else:
+        await queue_message(update, context, ctx, await fetch())
 
 
 async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -463,8 +623,8 @@ async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     if not voice:
         return
 
-    chat_id = update.effective_chat.id
-    thread_id = get_thread_id(update)
+    ctx = ctx_from_update(update)
+    chat_id, thread_id = ctx.chat_id, ctx.thread_id
 
     logger.info(
         "Voice/audio from %s (%d) in chat %d thread %d, duration=%s",
@@ -476,21 +636,25 @@ async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         user.id, user.username or user.first_name, getattr(voice, "duration", "?"),
     )
 
-    workspace = ensure_workspace(chat_id)
-    voice_dir = workspace / "uploads" / f"t{thread_id}" / "voice"
-    voice_dir.mkdir(parents=True, exist_ok=True)
+    ensure_workspace(chat_id)
+    voice_dir = ensure_dir(upload_dir(chat_id, thread_id, "voice"))
     ogg_path = voice_dir / f"{voice.file_id}.ogg"
 
-    file = await context.bot.get_file(voice.file_id)
-    await file.download_to_drive(ogg_path)
-
-    text = await transcribe(ogg_path)
     caption = update.message.caption or ""
-    claude_msg = f'[Voice message transcription]: "{text}"'
-    if caption:
-        claude_msg += f' User also wrote: "{caption}"'
 
-    await queue_message(update, context, chat_id, thread_id, user.id, claude_msg)
+    async def fetch_and_transcribe() -> str:
+        file = await context.bot.get_file(voice.file_id)
+        await download_file(file, ogg_path)
+        text = await transcribe(ogg_path)
+        claude_msg = f'[Voice message transcription]: "{text}"'
+        if caption:
+            claude_msg += f' User also wrote: "{caption}"'
+        return claude_msg
+
+    # Transcription is a remote round-trip; run it in the background so
+    # voice notes sent in quick succession are transcribed concurrently and
+    # land in the same batch.
+    await queue_message(update, context, ctx, asyncio.create_task(fetch_and_transcribe()))
 
 
 async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -506,8 +670,8 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     if not doc:
         return
 
-    chat_id = update.effective_chat.id
-    thread_id = get_thread_id(update)
+    ctx = ctx_from_update(update)
+    chat_id, thread_id = ctx.chat_id, ctx.thread_id
 
     logger.info(
         "Document from %s (%d) in chat %d thread %d: %s (%s bytes)",
@@ -519,22 +683,18 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         user.id, doc.file_name, doc.file_size,
     )
 
-    workspace = ensure_workspace(chat_id)
-    today = datetime.now().strftime("%Y-%m-%d")
-    dest_dir = workspace / "uploads" / f"t{thread_id}" / today
-    dest_dir.mkdir(parents=True, exist_ok=True)
-    safe_name = Path(doc.file_name).name if doc.file_name else f"file_{doc.file_id}"
+    ensure_workspace(chat_id)
+    today = _today_str()
+    dest_dir = ensure_dir(upload_dir(chat_id, thread_id, today))
+    safe_name = _safe_name(doc.file_name, f"file_{doc.file_id}")
     dest = dest_dir / safe_name
 
-    file = await context.bot.get_file(doc.file_id)
-    await file.download_to_drive(dest)
-
     caption = update.message.caption or ""
-    claude_msg = f"[File received: {dest.relative_to(workspace)}]"
+    claude_msg = f"[File received: uploads/t{thread_id}/{today}/{safe_name}]"
     if caption:
         claude_msg += f' User says: "{caption}"'
 
-    await queue_message(update, context, chat_id, thread_id, user.id, claude_msg)
+    await _download_and_queue(update, context, ctx, doc.file_id, dest, claude_msg)
 
 
 async def handle_video(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -550,8 +710,8 @@ async def handle_video(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     if not video:
         return
 
-    chat_id = update.effective_chat.id
-    thread_id = get_thread_id(update)
+    ctx = ctx_from_update(update)
+    chat_id, thread_id = ctx.chat_id, ctx.thread_id
 
     logger.info(
         "Video from %s (%d) in chat %d thread %d: %s (%s bytes)",
@@ -563,22 +723,18 @@ async def handle_video(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         user.id, video.file_name or video.file_id, video.file_size,
     )
 
-    workspace = ensure_workspace(chat_id)
-    today = datetime.now().strftime("%Y-%m-%d")
-    dest_dir = workspace / "uploads" / f"t{thread_id}" / today
-    dest_dir.mkdir(parents=True, exist_ok=True)
-    safe_name = Path(video.file_name).name if video.file_name else f"video_{video.file_id}.mp4"
+    ensure_workspace(chat_id)
+    today = _today_str()
+    dest_dir = ensure_dir(upload_dir(chat_id, thread_id, today))
+    safe_name = _safe_name(video.file_name, f"video_{video.file_id}.mp4")
     dest = dest_dir / safe_name
 
-    file = await context.bot.get_file(video.file_id)
-    await file.download_to_drive(dest)
-
     caption = update.message.caption or ""
-    claude_msg = f"[Video received: {dest.relative_to(workspace)}]"
+    claude_msg = f"[Video received: uploads/t{thread_id}/{today}/{safe_name}]"
     if caption:
         claude_msg += f' User says: "{caption}"'
 
-    await queue_message(update, context, chat_id, thread_id, user.id, claude_msg)
+    await _download_and_queue(update, context, ctx, video.file_id, dest, claude_msg)
 
 
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -596,8 +752,8 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 
     photo = photos[-1]
 
-    chat_id = update.effective_chat.id
-    thread_id = get_thread_id(update)
+    ctx = ctx_from_update(update)
+    chat_id, thread_id = ctx.chat_id, ctx.thread_id
 
     logger.info(
         "Photo from %s (%d) in chat %d thread %d, size=%dx%d",
@@ -609,18 +765,30 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         user.id, photo.width, photo.height,
     )
 
-    workspace = ensure_workspace(chat_id)
-    today = datetime.now().strftime("%Y-%m-%d")
-    dest_dir = workspace / "uploads" / f"t{thread_id}" / today
-    dest_dir.mkdir(parents=True, exist_ok=True)
-    dest = dest_dir / f"photo_{photo.file_unique_id}.jpg"
-
-    file = await context.bot.get_file(photo.file_id)
-    await file.download_to_drive(dest)
+    ensure_workspace(chat_id)
+    today = _today_str()
+    dest_dir = ensure_dir(upload_dir(chat_id, thread_id, today))
+    photo_name = f"photo_{photo.file_unique_id}.jpg"
+    dest = dest_dir / photo_name
 
     caption = update.message.caption or ""
-    claude_msg = f"[Photo received: {dest.relative_to(workspace)}]"
+    claude_msg = f"[Photo received: uploads/t{thread_id}/{today}/{photo_name}]"
     if caption:
         claude_msg += f' User says: "{caption}"'
 
-    await queue_message(update, context, chat_id, thread_id, user.id, claude_msg)
+    await _download_and_queue(update, context, ctx, photo.file_id, dest, claude_msg)
+
+
+async def handle_media(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Route an attachment to its handler (registered once for all media)."""
+    msg = update.message
+    if msg is None:
+        return
+    if msg.voice or msg.audio:
+        await handle_voice(update, context)
+    elif msg.video:
+        await handle_video(update, context)
+    elif msg.document:
+        await handle_document(update, context)
+    elif msg.photo:
+        await handle_photo(update, context)
@@ -4,6 +4,7 @@ import logging
 import logging.handlers
 
 from bot.config import LOGS_DIR, WORKSPACES_DIR
+from bot.lru import LRUDict
 
 logging.basicConfig(
     level=logging.INFO,
@@ -29,24 +30,43 @@ _infra_handler.setFormatter(_LOG_FORMAT)
 infra_logger.addHandler(_infra_handler)
 infra_logger.setLevel(logging.INFO)
 
-# Workspace logger factory — per-chat activity logs
-_workspace_loggers: dict[int, logging.Logger] = {}
+# Workspace logger factory — per-chat activity logs.
+# Each logger holds an open file handle, so keep only the recently active
+# ones open. Eviction just closes the file: a stream still holding the logger
+# keeps working, because FileHandler reopens its file on the next record.
+_MAX_WORKSPACE_LOGGERS = 256
+
+
+def _release_workspace_logger(chat_id: int, ws_logger: logging.Logger) -> None:
+    for handler in ws_logger.handlers:
+        handler.acquire()
+        try:
+            if handler.stream:
+                handler.stream.close()
+                handler.stream = None
+        finally:
+            handler.release()
+
+
+_workspace_loggers: LRUDict = LRUDict(_MAX_WORKSPACE_LOGGERS, on_evict=_release_workspace_logger)
 
 
 def get_workspace_logger(chat_id: int) -> logging.Logger:
     """Return a cached logger that writes to workspaces/c{chat_id}/logs/activity.log."""
-    if chat_id in _workspace_loggers:
-        return _workspace_loggers[chat_id]
-    ws_log_dir = WORKSPACES_DIR / f"c{chat_id}" / "logs"
-    ws_log_dir.mkdir(parents=True, exist_ok=True)
+    ws_logger = _workspace_loggers.get(chat_id)
+    if ws_logger is not None:
+        return ws_logger
     ws_logger = logging.getLogger(f"OpenClaude.ws.{chat_id}")
-    ws_logger.propagate = False
-    handler = logging.handlers.RotatingFileHandler(
-        ws_log_dir / "activity.log", maxBytes=2 * 1024 * 1024, backupCount=2
-    )
-    handler.setFormatter(_LOG_FORMAT)
-    ws_logger.addHandler(handler)
-    ws_logger.setLevel(logging.INFO)
+    if not ws_logger.handlers:  # first use in this process (not a re-admit after eviction)
+        ws_log_dir = WORKSPACES_DIR / f"c{chat_id}" / "logs"
+        ws_log_dir.mkdir(parents=True, exist_ok=True)
+        ws_logger.propagate = False
+        handler = logging.handlers.RotatingFileHandler(
+            ws_log_dir / "activity.log", maxBytes=2 * 1024 * 1024, backupCount=2, delay=True
+        )
+        handler.setFormatter(_LOG_FORMAT)
+        ws_logger.addHandler(handler)
+        ws_logger.setLevel(logging.INFO)
     _workspace_loggers[chat_id] = ws_logger
     return ws_logger
 
@@ -0,0 +1,66 @@
+"""Bounded LRU mapping for long-lived in-memory registries."""
+
+from collections import OrderedDict
+from typing import Callable
+
+
+class LRUDict(OrderedDict):
+    """OrderedDict capped at ``maxsize``; least recently used entries go first.
+
+    ``on_evict(key, value)`` is called for each evicted entry. Entries for which
+    ``pinned(value)`` is true are never evicted (e.g. a lock that is held),
+    so the mapping may briefly exceed ``maxsize`` while they are in use.
+    """
+
+    def __init__(self, maxsize: int, on_evict: Callable | None = None,
+                 pinned: Callable | None = None):
+        super().__init__()
+        self.maxsize = maxsize
+        self.on_evict = on_evict
+        self.pinned = pinned
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        self.move_to_end(key)
+        return value
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def setdefault(self, key, default=None):
+        if key in self:
+            return self[key]
+        self[key] = default
+        return default
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        if len(self) > self.maxsize:
+            self._evict()
+
+    def _evict(self) -> None:
+        while len(self) > self.maxsize:
+            if self.pinned is None:
+                key, value = self.popitem(last=False)
+            else:
+                key = self._oldest_unpinned()
+                if key is None:
+                    return
+                value = super().__getitem__(key)
+                super().__delitem__(key)
+            if self.on_evict:
+                self.on_evict(key, value)
+
+    def _oldest_unpinned(self):
+        # Walks only past pinned entries, and never returns the newest one:
+        # the caller is about to use it
+        newest = next(reversed(self))
+        for key in self:
+            if key == newest:
+                return None
+            if not self.pinned(super().__getitem__(key)):
+                return key
+        return None
@@ -1,5 +1,6 @@
 """Security rules (blocked patterns, permission handler, env building)."""
 
+import functools
 import os
 import re
 from pathlib import Path
@@ -15,8 +16,12 @@ _SAFE_ENV_KEYS = {
     "PYTHONPATH", "NODE_PATH",
 }
 
+def _compile_rules(rules: list[tuple[str, str]]) -> list[tuple[re.Pattern, str]]:
+    return [(re.compile(pattern, re.IGNORECASE), msg) for pattern, msg in rules]
+
+
 # Patterns blocked for ALL users
-_BLOCKED_ALL_BASH = [
+_BLOCKED_ALL_BASH = _compile_rules([
     (r"systemctl|service\s+(stop|restart|start)|kill\s|pkill\s|killall\s|claude-telegram-bot|ouroboros",
      "You are not allowed to manage system services. Use ./bin/restart.sh for the bot."),
     (r"sshd|ssh_config|authorized_keys|/etc/ssh",
@@ -29,17 +34,23 @@ _BLOCKED_ALL_BASH = [
      "You are not allowed to modify PAM or NSS configuration."),
     (r"\b(passwd|usermod|userdel|chage)\b.*\broot\b|deluser\s+root",
      "You are not allowed to modify the root account."),
-]
+])
 
 # Additional patterns blocked for non-admin
-_BLOCKED_NONADMIN_BASH = [
+_BLOCKED_NONADMIN_BASH = _compile_rules([
     (r"\benv\b|\bprintenv\b|/proc/.*environ|\bset\b\s*$|\bexport\s+-p\b",
      "You are not allowed to inspect host environment variables."),
     (r"\.config/(gh|git)/|\.claude/\.credentials|\.netrc|\.npmrc|\.pypirc|/etc/shadow|\.ssh/|\.aws/|\.kube/",
      "You are not allowed to access credential files."),
     (r"cat.*/OpenClaude/\.env|head.*/OpenClaude/\.env|tail.*/OpenClaude/\.env|less.*/OpenClaude/\.env|more.*/OpenClaude/\.env",
      "You are not allowed to read the host .env file."),
-]
+])
+
+# Non-admin permission changes and recursive deletes, allowed only inside the workspace
+_CHMOD_RE = re.compile(r"\b(chmod|chown)\b", re.IGNORECASE)
+_RM_RF_RE = re.compile(
+    r"\brm\s+.*-[a-zA-Z]*r[a-zA-Z]*f|\brm\s+.*-[a-zA-Z]*f[a-zA-Z]*r", re.IGNORECASE
+)
 
 # Protected file paths for Write/Edit
 _BLOCKED_WRITE_PATHS = re.compile(
@@ -69,8 +80,9 @@ def load_workspace_env(workspace_dir: str) -> dict[str, str]:
     return result
 
 
-def build_env(is_admin: bool, cwd: str, thread_id: int) -> dict[str, str]:
-    """Build the environment dict for a Claude subprocess."""
+@functools.cache
+def _base_env(is_admin: bool) -> dict[str, str]:
+    """Process env filtered for the role, with PATH patched. Built once per role."""
     if is_admin:
         env = os.environ.copy()
     else:
@@ -81,15 +93,16 @@ def build_env(is_admin: bool, cwd: str, thread_id: int) -> dict[str, str]:
     local_bin = str(Path.home() / ".local" / "bin")
     if local_bin not in env.get("PATH", ""):
         env["PATH"] = local_bin + ":" + env.get("PATH", "/usr/bin:/bin")
+    return env
 
-    workspace_env = load_workspace_env(cwd)
-    env.update(workspace_env)
 
+def build_env(is_admin: bool, cwd: str, thread_id: int) -> dict[str, str]:
+    """Build the environment dict for a Claude subprocess."""
+    env = {**_base_env(is_admin), **load_workspace_env(cwd)}
     env["IS_SANDBOX"] = "1"
     env["OPENCLAUDE_IS_ADMIN"] = "1" if is_admin else "0"
     env["OPENCLAUDE_WORKSPACE"] = cwd
     env["OPENCLAUDE_THREAD_ID"] = str(thread_id)
-
     return env
 
 
@@ -104,20 +117,20 @@ def make_permission_handler(is_admin: bool, workspace: str):
                 return PermissionResultAllow(updated_input=input_data)
 
             for pattern, msg in _BLOCKED_ALL_BASH:
-                if re.search(pattern, cmd, re.IGNORECASE):
+                if pattern.search(cmd):
                     return PermissionResultDeny(message=f"BLOCKED: {msg}")
 
             if not is_admin:
                 for pattern, msg in _BLOCKED_NONADMIN_BASH:
-                    if re.search(pattern, cmd, re.IGNORECASE):
+                    if pattern.search(cmd):
                         return PermissionResultDeny(message=f"BLOCKED: {msg}")
 
-                if re.search(r"\b(chmod|chown)\b", cmd, re.IGNORECASE):
+                if _CHMOD_RE.search(cmd):
                     if workspace not in cmd:
                         return PermissionResultDeny(
                             message="BLOCKED: You can only change permissions on files within your workspace.")
 
-                if re.search(r"\brm\s+.*-[a-zA-Z]*r[a-zA-Z]*f|\brm\s+.*-[a-zA-Z]*f[a-zA-Z]*r", cmd, re.IGNORECASE):
+                if _RM_RF_RE.search(cmd):
                     if workspace not in cmd:
                         return PermissionResultDeny(
                             message="BLOCKED: You can only delete files within your workspace.")
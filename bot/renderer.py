@@ -1,10 +1,37 @@
 """TelegramRenderer + message splitting."""
 
+import functools
 import html
 import re
+from typing import Iterator
 
 from bot.config import TELEGRAM_MAX_LENGTH
 
+_HTML_TAG_RE = re.compile(r"<[^>]+>")
+# Opening/closing tag and its name; render() escapes every other "<"
+_HTML_TAG_NAME_RE = re.compile(r"<(/?)([a-z]+)[^>]*>")
+
+# Markdown patterns used by TelegramRenderer.render, in application order
+# Fenced blocks and inline spans in one scan. An inline span may not close on
+# the opening backtick of a fence that has a closing fence later on: that
+# backtick belongs to the block.
+_CODE_RE = re.compile(r"```(\w*)\n?(.*?)```|`([^`\n]+)`(?!``.*?```)", re.DOTALL)
+_HEADING_RE = re.compile(r"^#{1,6}\s+(.+)$", re.MULTILINE)
+_BOLD_STAR_RE = re.compile(r"\*\*(.+?)\*\*")
+_BOLD_UNDER_RE = re.compile(r"__(.+?)__")
+_ITALIC_STAR_RE = re.compile(r"(?<!\w)\*([^*]+?)\*(?!\w)")
+_ITALIC_UNDER_RE = re.compile(r"(?<!\w)_([^_]+?)_(?!\w)")
+_STRIKE_RE = re.compile(r"~~(.+?)~~")
+_LINK_RE = re.compile(r"\[([^\]]+)\]\(([^)]+)\)")
+# Unordered and ordered list markers; group 1 is the number for ordered items
+_LIST_RE = re.compile(r"^\s*(?:[-*]|(\d+)\.)\s+", re.MULTILINE)
+_PLACEHOLDER_RE = re.compile(r"\x00(CODEBLOCK|INLINECODE)(\d+)\x00")
+
+
+def _list_marker(m: re.Match) -> str:
+    number = m.group(1)
+    return f"  {number}. " if number else "  \u2022 "
+
 
 class TelegramRenderer:
     """Convert markdown-ish text to Telegram-compatible HTML."""
@@ -15,11 +42,26 @@ class TelegramRenderer:
 
         Handles: code blocks, inline code, bold, italic, strikethrough,
         headings (as bold), links, and lists.
+
+        Pure, so texts that fit in one message are memoized: the streaming
+        path renders the final text for the live-message edit, and
+        send_rendered re-renders the same chunk if that edit falls back.
         """
-        # Protect code blocks first
+        if len(text) <= TELEGRAM_MAX_LENGTH:
+            return TelegramRenderer._render_cached(text)
+        return TelegramRenderer._render(text)
+
+    @staticmethod
+    def _render(text: str) -> str:
+        # Protect code blocks and inline code in a single scan
         code_blocks: list[str] = []
+        inline_codes: list[str] = []
 
-        def _save_code_block(m: re.Match) -> str:
+        def _save_code(m: re.Match) -> str:
+            inline = m.group(3)
+            if inline is not None:
+                inline_codes.append(f"<code>{html.escape(inline)}</code>")
+                return f"\x00INLINECODE{len(inline_codes) - 1}\x00"
             lang = m.group(1) or ""
             code = html.escape(m.group(2))
             if lang:
@@ -29,87 +71,119 @@ class TelegramRenderer:
             code_blocks.append(block)
             return f"\x00CODEBLOCK{len(code_blocks) - 1}\x00"
 
-        text = re.sub(
-            r"```(\w*)\n?(.*?)```", _save_code_block, text, flags=re.DOTALL
-        )
-
-        # Protect inline code
-        inline_codes: list[str] = []
-
-        def _save_inline_code(m: re.Match) -> str:
-            code = html.escape(m.group(1))
-            inline_codes.append(f"<code>{code}</code>")
-            return f"\x00INLINECODE{len(inline_codes) - 1}\x00"
-
-        text = re.sub(r"`([^`\n]+)`", _save_inline_code, text)
+        text = _CODE_RE.sub(_save_code, text)
 
         # Escape HTML in the remaining text
         text = html.escape(text)
 
         # Headings -> bold
-        text = re.sub(r"^#{1,6}\s+(.+)$", r"<b>\1</b>", text, flags=re.MULTILINE)
+        text = _HEADING_RE.sub(r"<b>\1</b>", text)
 
         # Bold: **text** or __text__
-        text = re.sub(r"\*\*(.+?)\*\*", r"<b>\1</b>", text)
-        text = re.sub(r"__(.+?)__", r"<b>\1</b>", text)
+        text = _BOLD_STAR_RE.sub(r"<b>\1</b>", text)
+        text = _BOLD_UNDER_RE.sub(r"<b>\1</b>", text)
 
         # Italic: *text* or _text_
-        text = re.sub(r"(?<!\w)\*([^*]+?)\*(?!\w)", r"<i>\1</i>", text)
-        text = re.sub(r"(?<!\w)_([^_]+?)_(?!\w)", r"<i>\1</i>", text)
+        text = _ITALIC_STAR_RE.sub(r"<i>\1</i>", text)
+        text = _ITALIC_UNDER_RE.sub(r"<i>\1</i>", text)
 
         # Strikethrough: ~~text~~
-        text = re.sub(r"~~(.+?)~~", r"<s>\1</s>", text)
+        text = _STRIKE_RE.sub(r"<s>\1</s>", text)
 
         # Links: [text](url)
-        text = re.sub(r"\[([^\]]+)\]\(([^)]+)\)", r'<a href="\2">\1</a>', text)
-
-        # Unordered lists
-        text = re.sub(r"^[\s]*[-*]\s+", "  \u2022 ", text, flags=re.MULTILINE)
+        text = _LINK_RE.sub(r'<a href="\2">\1</a>', text)
 
-        # Ordered lists
-        text = re.sub(
-            r"^[\s]*(\d+)\.\s+", r"  \1. ", text, flags=re.MULTILINE
-        )
+        # Lists: bullets for unordered items, indented numbers for ordered ones
+        text = _LIST_RE.sub(_list_marker, text)
 
-        # Restore code blocks and inline code
-        for i, block in enumerate(code_blocks):
-            text = text.replace(f"\x00CODEBLOCK{i}\x00", block)
-        for i, code in enumerate(inline_codes):
-            text = text.replace(f"\x00INLINECODE{i}\x00", code)
+        # Restore code blocks and inline code in one pass
+        if code_blocks or inline_codes:
+            text = _PLACEHOLDER_RE.sub(
+                lambda m: (code_blocks if m.group(1) == "CODEBLOCK" else inline_codes)[int(m.group(2))],
+                text,
+            )
 
         return text.strip()
 
+    # Only message-sized texts repeat (a live edit and its fallback send), and
+    # back to back; longer ones are never sent whole, so caching them would
+    # only pin large strings in memory
+    _render_cached = staticmethod(functools.lru_cache(maxsize=32)(_render.__func__))
+
+
+def strip_tags(text: str) -> str:
+    """Turn rendered HTML back into plain text (plain-text send fallback).
+
+    Entities are decoded too, otherwise the fallback shows ``&lt;`` etc.
+    """
+    return html.unescape(_HTML_TAG_RE.sub("", text))
+
+
+def is_balanced_html(text: str) -> bool:
+    """Whether every tag in rendered HTML is closed, in nesting order.
+
+    Overlapping markdown can render to mis-nested tags (``<b><i>x</b></i>``),
+    which Telegram rejects; checking first lets callers go straight to the
+    plain-text fallback instead of paying for a failed send.
+    """
+    if "<" not in text:
+        return True
+    stack: list[str] = []
+    for m in _HTML_TAG_NAME_RE.finditer(text):
+        closing, name = m.groups()
+        if not closing:
+            stack.append(name)
+        elif not stack or stack.pop() != name:
+            return False
+    return not stack
+
 
 def split_message(text: str, max_length: int = TELEGRAM_MAX_LENGTH) -> list[str]:
     """Split a message into chunks that fit within Telegram's limit."""
+    # Common case: most replies fit in one message, skip the split-point scan
     if len(text) <= max_length:
         return [text]
+    return list(iter_split_message(text, max_length))
+
+
+def iter_split_message(text: str, max_length: int = TELEGRAM_MAX_LENGTH) -> Iterator[str]:
+    """Yield the chunks of split_message one at a time.
 
-    chunks: list[str] = []
-    remaining = text
+    Walks the text by offset instead of re-slicing the remainder after every
+    chunk, so long texts are split in linear time.
+    """
+    if len(text) <= max_length:
+        yield text
+        return
+
+    n = len(text)
+    min_split = max_length // 3
+    pos = 0
 
-    while remaining:
-        if len(remaining) <= max_length:
-            chunks.append(remaining)
-            break
+    while pos < n:
+        if n - pos <= max_length:
+            yield text[pos:]
+            return
 
-        split_at = max_length
+        end = pos + max_length
+        split_at = end
 
-        # Try paragraph break
-        para_break = remaining.rfind("\n\n", 0, max_length)
-        if para_break > max_length // 3:
+        # Try paragraph break, then line, sentence, word. Breaks in the first
+        # third are rejected, so only the last two thirds are searched.
+        lo = pos + min_split + 1
+        if (para_break := text.rfind("\n\n", lo, end)) >= 0:
             split_at = para_break
-        elif (line_break := remaining.rfind("\n", 0, max_length)) > max_length // 3:
+        elif (line_break := text.rfind("\n", lo, end)) >= 0:
             split_at = line_break
-        elif (sentence_end := remaining.rfind(". ", 0, max_length)) > max_length // 3:
+        elif (sentence_end := text.rfind(". ", lo, end)) >= 0:
             split_at = sentence_end + 1
-        elif (space := remaining.rfind(" ", 0, max_length)) > max_length // 3:
+        elif (space := text.rfind(" ", lo, end)) >= 0:
             split_at = space
 
-        chunk = remaining[:split_at].rstrip()
-        remaining = remaining[split_at:].lstrip()
+        chunk = text[pos:split_at].rstrip()
+        pos = split_at
+        while pos < n and text[pos].isspace():
+            pos += 1
 
         if chunk:
-            chunks.append(chunk)
-
-    return chunks
+            yield chunk
@@ -1,10 +1,12 @@
 """SDKSession class, idle cleanup, shutdown."""
 
 import asyncio
+import heapq
 import time
 
-from bot.config import SDK_IDLE_TIMEOUT
+from bot.config import MAX_TRACKED_SESSIONS, SDK_IDLE_TIMEOUT
 from bot.logging_setup import logger
+from bot.lru import LRUDict
 
 # Claude Code SDK — persistent session support
 try:
@@ -48,31 +50,83 @@ except ImportError:
     PermissionResultDeny = None
     StreamEvent = None
 
-# Global dict: session_key -> SDKSession
-sdk_sessions: dict[str, "SDKSession"] = {}
+def _evict_session(key: str, session: "SDKSession") -> None:
+    logger.info("Evicting least recently used SDK session: %s", key)
+    asyncio.create_task(session.disconnect())
+
+
+def _session_busy(session: "SDKSession") -> bool:
+    return session.in_use > 0 or session.lock.locked() or session.state == CONNECTING
+
+
+# Global LRU: session_key -> SDKSession. Only idle sessions are evicted (and
+# disconnected in the background); busy ones may briefly exceed the cap.
+sdk_sessions: LRUDict = LRUDict(
+    MAX_TRACKED_SESSIONS, on_evict=_evict_session, pinned=_session_busy
+)
+
+# Min-heap of (expiry_ts, session_key). Stale entries are skipped lazily on pop.
+_expiry_heap: list[tuple[float, str]] = []
+
+
+# SDKSession connection states
+IDLE = "idle"
+CONNECTING = "connecting"
+CONNECTED = "connected"
+BROKEN = "broken"
 
 
 class SDKSession:
-    """Wraps a ClaudeSDKClient with lifecycle management."""
+    """Wraps a ClaudeSDKClient with lifecycle management.
+
+    A session stays registered in sdk_sessions after an error: it is marked
+    BROKEN and the next ensure_connected() reconnects it under self.lock, so
+    concurrent callers never race to replace it with fresh connections.
+    """
 
     def __init__(self):
         self.client = None
         self.session_id: str | None = None
-        self.last_activity: float = time.time()
+        self.last_activity: float = time.monotonic()
         self.lock: asyncio.Lock = asyncio.Lock()
-        self.connected: bool = False
+        self.state: str = IDLE
+        self.in_use: int = 0  # queries currently streaming on this session
+
+    @property
+    def connected(self) -> bool:
+        return self.state == CONNECTED
 
     async def ensure_connected(self, options) -> None:
         """Connect the SDK client if not already connected."""
-        if self.connected and self.client:
+        if self.state == CONNECTED and self.client:
             return
-        self.client = ClaudeSDKClient(options=options)
-        await self.client.connect()
-        self.connected = True
-        self.last_activity = time.time()
+        async with self.lock:
+            if self.state == CONNECTED and self.client:
+                return
+            if self.state == BROKEN:
+                logger.info("Reconnecting broken SDK session %s", self.session_id or "new")
+                await self._close_client()
+            self.state = CONNECTING
+            try:
+                self.client = ClaudeSDKClient(options=options)
+                await self.client.connect()
+            except Exception:
+                self.state = BROKEN
+                raise
+            self.state = CONNECTED
+            self.last_activity = time.monotonic()
+
+    async def mark_broken(self) -> None:
+        """Drop the client after an error; the next ensure_connected() reconnects."""
+        await self._close_client()
+        self.state = BROKEN
 
     async def disconnect(self) -> None:
         """Disconnect the SDK client."""
+        await self._close_client()
+        self.state = IDLE
+
+    async def _close_client(self) -> None:
         if self.client:
             try:
                 await self.client.disconnect()
@@ -80,20 +134,33 @@ class SDKSession:
                 logger.debug("SDKSession disconnect error: %s", e)
             finally:
                 self.client = None
-                self.connected = False
+
+
+def mark_active(key: str, session: SDKSession) -> None:
+    """Record activity on a session and schedule its idle expiry."""
+    session.last_activity = time.monotonic()
+    heapq.heappush(_expiry_heap, (session.last_activity + SDK_IDLE_TIMEOUT, key))
 
 
 async def cleanup_idle_sessions():
-    """Periodic task to disconnect idle SDK sessions."""
+    """Disconnect SDK sessions as their idle deadlines come due."""
     while True:
-        await asyncio.sleep(60)
-        now = time.time()
-        expired = [k for k, s in sdk_sessions.items()
-                   if now - s.last_activity > SDK_IDLE_TIMEOUT]
-        for key in expired:
-            session = sdk_sessions.pop(key)
-            logger.info("Disconnecting idle SDK session: %s", key)
-            await session.disconnect()
+        if not _expiry_heap:
+            await asyncio.sleep(60)
+            continue
+        expiry, key = _expiry_heap[0]
+        delay = expiry - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+            continue
+        heapq.heappop(_expiry_heap)
+        session = sdk_sessions.get(key)
+        # Stale entry: session gone or touched again since this deadline was pushed
+        if session is None or time.monotonic() - session.last_activity < SDK_IDLE_TIMEOUT:
+            continue
+        sdk_sessions.pop(key, None)
+        logger.info("Disconnecting idle SDK session: %s", key)
+        await session.disconnect()
 
 
 async def shutdown_sdk_sessions():
@@ -102,3 +169,4 @@ async def shutdown_sdk_sessions():
         logger.info("Shutting down SDK session: %s", key)
         await session.disconnect()
     sdk_sessions.clear()
+    _expiry_heap.clear()
@@ -1,55 +1,213 @@
-"""Session persistence (load/save/clear session IDs)."""
+"""Session persistence (load/save/clear session IDs).
 
+On disk the mapping is a JSON snapshot plus a JSONL log of later changes
+(one line per update, replayed on load), so an update costs one appended
+line instead of a rewrite of every session. The log is folded back into the
+snapshot once it grows past COMPACT_RATIO x the number of sessions.
+
+In memory the mapping is loaded once; updates are appended on a short
+debounce (and on shutdown via flush_sessions).
+"""
+
+import asyncio
+import functools
 import json
 import os
 import tempfile
+import time
+from dataclasses import dataclass
 from datetime import datetime
+from pathlib import Path
 
-from bot.config import SESSION_FILE
+from bot.config import ADMIN_USER_ID, SESSION_FILE
 from bot.logging_setup import logger
 
+# orjson is optional; loads accepts bytes and raises a json.JSONDecodeError subclass
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-def load_sessions() -> dict:
-    """Load session mapping from disk."""
+
+def _loads(data: bytes):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def _dumps(obj) -> bytes:
+    """Compact JSON; the files are machine-read, so no indentation."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+FLUSH_DELAY = 0.5  # seconds to coalesce session updates before writing
+COMPACT_RATIO = 10
+COMPACT_MIN_LINES = 100
+
+_sessions: dict | None = None
+_sessions_file: Path | None = None  # file _sessions was loaded from
+_log_lines = 0  # lines currently in the change log
+_pending: dict[str, dict | None] = {}  # key -> new entry, None = deleted
+_flush_handle: asyncio.TimerHandle | None = None
+
+
+def _log_file() -> Path:
+    return SESSION_FILE.with_suffix(".jsonl")
+
+
+def _read_sessions() -> dict:
+    global _log_lines
+    sessions = {}
     if SESSION_FILE.exists():
         try:
-            return json.loads(SESSION_FILE.read_text())
+            sessions = _loads(SESSION_FILE.read_bytes())
         except (json.JSONDecodeError, OSError) as e:
             logger.warning("Failed to load sessions: %s", e)
-    return {}
+    _log_lines = 0
+    torn = False
+    try:
+        with open(_log_file(), "rb") as f:
+            for line in f:
+                _log_lines += 1
+                try:
+                    rec = _loads(line)
+                except json.JSONDecodeError:
+                    torn = True  # torn last line from a crash mid-append
+                    continue
+                if rec.get("entry") is None:
+                    sessions.pop(rec["key"], None)
+                else:
+                    sessions[rec["key"]] = rec["entry"]
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning("Failed to replay session log: %s", e)
+    if torn:
+        # Rewrite without the partial record, or the next append would be
+        # glued onto it and lost on the following load
+        logger.warning("Session log had a torn line, compacting")
+        save_sessions(sessions)
+    return sessions
+
+
+def load_sessions() -> dict:
+    """Return the in-memory session mapping, loading it from disk on first use.
+
+    Callers must treat the result as read-only; use set_session_id/clear_session.
+    """
+    global _sessions, _sessions_file
+    if _sessions is None or _sessions_file != SESSION_FILE:
+        _pending.clear()
+        _sessions = _read_sessions()
+        _sessions_file = SESSION_FILE
+    return _sessions
+
+
+def flush_sessions() -> None:
+    """Append pending session updates to the log now, compacting if it is long."""
+    global _flush_handle, _log_lines
+    if _flush_handle is not None:
+        _flush_handle.cancel()
+        _flush_handle = None
+    if not _pending or _sessions is None:
+        return
+    count = len(_pending)
+    lines = b"".join(
+        _dumps({"key": key, "entry": entry}) + b"\n" for key, entry in _pending.items()
+    )
+    _pending.clear()
+    if _log_lines + count > max(COMPACT_RATIO * len(_sessions), COMPACT_MIN_LINES):
+        save_sessions(_sessions)
+        return
+    try:
+        with open(_log_file(), "ab") as f:
+            f.write(lines)
+        _log_lines += count
+    except OSError as e:
+        logger.warning("Failed to append session log, rewriting snapshot: %s", e)
+        save_sessions(_sessions)
+
+
+def _mark_dirty(key: str) -> None:
+    """Queue key's current entry; flush later, or now when no event loop is running."""
+    global _flush_handle
+    _pending[key] = _sessions.get(key)
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        flush_sessions()
+        return
+    if _flush_handle is None:
+        _flush_handle = loop.call_later(FLUSH_DELAY, flush_sessions)
 
 
 def save_sessions(sessions: dict) -> None:
-    """Persist session mapping to disk (atomic write with fallback)."""
-    data = json.dumps(sessions, indent=2)
+    """Persist the full mapping as a new snapshot (atomic write with fallback).
+
+    The snapshot supersedes the change log, which is removed afterwards.
+    """
+    global _sessions, _sessions_file, _log_lines
+    _sessions, _sessions_file = sessions, SESSION_FILE
+    _pending.clear()
+    data = _dumps(sessions)
     tmp_path = None
     try:
         fd, tmp_path = tempfile.mkstemp(
             dir=SESSION_FILE.parent, suffix=".tmp"
         )
-        with os.fdopen(fd, "w") as f:
+        with os.fdopen(fd, "wb") as f:
             f.write(data)
         os.replace(tmp_path, SESSION_FILE)
         tmp_path = None
     except OSError:
         try:
-            SESSION_FILE.write_text(data)
+            SESSION_FILE.write_bytes(data)
             logger.warning("save_sessions: atomic replace failed, used direct write")
         except OSError as e2:
             logger.error("Failed to save sessions: %s", e2)
+            return
     finally:
         if tmp_path:
             try:
                 os.unlink(tmp_path)
             except OSError:
                 pass
+    _log_file().unlink(missing_ok=True)
+    _log_lines = 0
 
 
+@functools.lru_cache(maxsize=4096)
 def session_key(chat_id: int, thread_id: int, user_id: int) -> str:
-    """Build a composite session key: chat_id:thread_id:user_id."""
+    """Build a composite session key: chat_id:thread_id:user_id.
+
+    Memoized: the same few keys are rebuilt on every message and stream event.
+    """
     return f"{chat_id}:{thread_id}:{user_id}"
 
 
+@dataclass(slots=True, frozen=True)
+class RequestCtx:
+    """Identity of one Claude request, computed once and passed down the call chain."""
+    chat_id: int
+    thread_id: int
+    user_id: int      # Telegram sender
+    session_uid: int  # sender in private chats, 0 in groups (one shared session)
+    key: str          # session_key(chat_id, thread_id, session_uid)
+    is_admin: bool
+
+
+def request_ctx(chat_id: int, thread_id: int, user_id: int, private: bool = True) -> RequestCtx:
+    """Build a RequestCtx. Group chats share one session per thread."""
+    session_uid = user_id if private else 0
+    return RequestCtx(
+        chat_id=chat_id,
+        thread_id=thread_id,
+        user_id=user_id,
+        session_uid=session_uid,
+        key=session_key(chat_id, thread_id, session_uid),
+        is_admin=ADMIN_USER_ID is not None and session_uid == ADMIN_USER_ID,
+    )
+
+
 def get_session_id(chat_id: int, thread_id: int, user_id: int) -> str | None:
     """Get the Claude session ID for a given chat/thread/user combination."""
     sessions = load_sessions()
@@ -62,8 +220,18 @@ def set_session_id(chat_id: int, thread_id: int, user_id: int, sid: str) -> None
     sessions = load_sessions()
     key = session_key(chat_id, thread_id, user_id)
     sessions.setdefault(key, {})["session_id"] = sid
-    sessions[key]["updated_at"] = datetime.now().isoformat()
-    save_sessions(sessions)
+    sessions[key]["updated_at"] = int(time.time())
+    _mark_dirty(key)
+
+
+def format_updated_at(value) -> str:
+    """Render a session's updated_at for display.
+
+    Stored as epoch seconds; older files hold an ISO string, shown as is.
+    """
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value).isoformat(timespec="seconds")
+    return str(value)
 
 
 def clear_session(chat_id: int, thread_id: int, user_id: int) -> None:
@@ -72,4 +240,4 @@ def clear_session(chat_id: int, thread_id: int, user_id: int) -> None:
     key = session_key(chat_id, thread_id, user_id)
     if key in sessions:
         del sessions[key]
-        save_sessions(sessions)
+        _mark_dirty(key)
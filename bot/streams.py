@@ -1,13 +1,30 @@
-"""Active stream tracking (file-backed for crash recovery)."""
+"""Active stream tracking (file-backed for crash recovery).
 
+The registry lives in memory and is mirrored to disk on a short debounce,
+so a burst of stream starts/stops costs one write instead of one per event.
+"""
+
+import asyncio
 import json
 import os
 import tempfile
 
+# orjson is optional; loads accepts bytes and raises a json.JSONDecodeError subclass
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 from bot.config import ACTIVE_STREAMS_FILE
 from bot.logging_setup import logger
 from bot.sessions import session_key
 
+FLUSH_DELAY = 0.5  # seconds to coalesce registry changes before writing
+
+_active_streams: dict[str, dict] = {}
+_dirty = False
+_flush_handle: asyncio.TimerHandle | None = None
+
 
 def save_active_streams(streams: dict) -> None:
     """Atomic write of active streams to disk."""
@@ -15,8 +32,9 @@ def save_active_streams(streams: dict) -> None:
         fd, tmp_path = tempfile.mkstemp(
             dir=ACTIVE_STREAMS_FILE.parent, suffix=".tmp"
         )
-        with os.fdopen(fd, "w") as f:
-            json.dump(streams, f, indent=2)
+        data = orjson.dumps(streams) if orjson is not None else json.dumps(streams).encode()
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
         os.replace(tmp_path, ACTIVE_STREAMS_FILE)
     except OSError as e:
         logger.error("Failed to save active streams: %s", e)
@@ -26,26 +44,55 @@ def load_active_streams() -> dict:
     """Read active streams from disk."""
     if ACTIVE_STREAMS_FILE.exists():
         try:
-            return json.loads(ACTIVE_STREAMS_FILE.read_text())
+            data = ACTIVE_STREAMS_FILE.read_bytes()
+            return orjson.loads(data) if orjson is not None else json.loads(data)
         except (json.JSONDecodeError, OSError):
             pass
     return {}
 
 
+def active_stream_count() -> int:
+    """Number of streams running now, including changes not yet on disk."""
+    return len(_active_streams)
+
+
+def flush_active_streams() -> None:
+    """Write pending registry changes to disk. Deletes the file when empty."""
+    global _dirty, _flush_handle
+    if _flush_handle is not None:
+        _flush_handle.cancel()
+        _flush_handle = None
+    if not _dirty:
+        return
+    _dirty = False
+    if _active_streams:
+        save_active_streams(_active_streams)
+    else:
+        ACTIVE_STREAMS_FILE.unlink(missing_ok=True)
+
+
+def _mark_dirty() -> None:
+    """Schedule a flush, or write immediately when no event loop is running."""
+    global _dirty, _flush_handle
+    _dirty = True
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        flush_active_streams()
+        return
+    if _flush_handle is None:
+        _flush_handle = loop.call_later(FLUSH_DELAY, flush_active_streams)
+
+
 def add_active_stream(chat_id: int, thread_id: int, user_id: int) -> None:
-    """Register a stream start. Survives crashes because it's on disk."""
-    streams = load_active_streams()
+    """Register a stream start. Reaches disk within FLUSH_DELAY."""
     key = session_key(chat_id, thread_id, user_id)
-    streams[key] = {"chat_id": chat_id, "thread_id": thread_id, "user_id": user_id}
-    save_active_streams(streams)
+    _active_streams[key] = {"chat_id": chat_id, "thread_id": thread_id, "user_id": user_id}
+    _mark_dirty()
 
 
 def remove_active_stream(chat_id: int, thread_id: int, user_id: int) -> None:
-    """Remove a completed stream. Deletes file when empty."""
-    streams = load_active_streams()
+    """Remove a completed stream."""
     key = session_key(chat_id, thread_id, user_id)
-    streams.pop(key, None)
-    if streams:
-        save_active_streams(streams)
-    else:
-        ACTIVE_STREAMS_FILE.unlink(missing_ok=True)
+    if _active_streams.pop(key, None) is not None:
+        _mark_dirty()
@@ -1,7 +1,9 @@
 """Per-chat workspace creation, symlinks, memory."""
 
+import functools
 import os
 import shutil
+import time
 from pathlib import Path
 
 from bot.config import WORKSPACES_DIR, WORKING_DIR
@@ -10,9 +12,15 @@ from bot.logging_setup import logger
 # Shared files are symlinked into each workspace so updates propagate automatically
 _SYMLINKED_FILES = ["TOOLS.md", "CLAUDE.md"]
 _SYMLINKED_DIRS = [".claude"]
-# BOOTSTRAP.md is always freshly copied so new sessions run the first-run ritual
+# BOOTSTRAP.md is copied once, when a workspace is created; Claude deletes it
+# after the first-run ritual, so it must not be restored on later sessions
 _BOOTSTRAP_FILE = "BOOTSTRAP.md"
 
+# chat_id -> (checked_at, workspace): skip the exists()/symlink checks for
+# WORKSPACE_RECHECK seconds after a workspace was last verified
+WORKSPACE_RECHECK = 300.0
+_ready_workspaces: dict[int, tuple[float, Path]] = {}
+
 
 def ensure_workspace(chat_id: int) -> Path:
     """Create and return an isolated workspace directory for the given chat.
@@ -25,33 +33,28 @@ def ensure_workspace(chat_id: int) -> Path:
         SOUL.md        <- independent copy (set up via BOOTSTRAP.md)
         IDENTITY.md    <- independent copy (set up via BOOTSTRAP.md)
         USER.md        <- independent copy
-        BOOTSTRAP.md   <- fresh copy every new session
+        BOOTSTRAP.md   <- copied at creation, deleted after first run
         memory/        <- isolated per-chat memory
           MEMORY.md
     """
+    now = time.monotonic()
+    cached = _ready_workspaces.get(chat_id)
+    if cached is not None and now - cached[0] < WORKSPACE_RECHECK:
+        return cached[1]
+
     workspace = WORKSPACES_DIR / f"c{chat_id}"
     if workspace.exists():
         _sync_workspace_links(workspace)
+        _ready_workspaces[chat_id] = (now, workspace)
         return workspace
 
     workspace.mkdir(parents=True, exist_ok=True)
     base = Path(WORKING_DIR)
 
-    # Symlink shared files
-    for fname in _SYMLINKED_FILES:
-        src = base / fname
-        dst = workspace / fname
-        if src.exists() and not dst.exists():
-            dst.symlink_to(os.path.relpath(src, workspace))
-
-    # Symlink shared directories
-    for dname in _SYMLINKED_DIRS:
-        src = base / dname
-        dst = workspace / dname
-        if src.exists() and not dst.exists():
-            dst.symlink_to(os.path.relpath(src, workspace))
-
-    # Always copy BOOTSTRAP.md fresh so new sessions run the first-run ritual
+    # Symlink shared files and directories (nothing is present yet)
+    _link_shared(workspace, set())
+
+    # Fresh workspace: copy BOOTSTRAP.md so the first session runs the ritual
     bootstrap = base / _BOOTSTRAP_FILE
     if bootstrap.exists():
         shutil.copy2(bootstrap, workspace / _BOOTSTRAP_FILE)
@@ -65,22 +68,64 @@ def ensure_workspace(chat_id: int) -> Path:
         shutil.copy2(mem_template, mem_dst)
 
     logger.info("Created workspace for chat %d at %s", chat_id, workspace)
+    _ready_workspaces[chat_id] = (now, workspace)
     return workspace
 
 
+def _entry_names(path: Path) -> set[str]:
+    """Names in a directory from one scandir, instead of a stat per candidate."""
+    try:
+        with os.scandir(path) as it:
+            return {e.name for e in it}
+    except FileNotFoundError:
+        return set()
+
+
+def _link_shared(workspace: Path, present: set[str]) -> None:
+    """Symlink each shared file/dir that exists in WORKING_DIR but not in present."""
+    base = Path(WORKING_DIR)
+    shared = _entry_names(base)
+    for name in (*_SYMLINKED_FILES, *_SYMLINKED_DIRS):
+        # present also covers dangling links, which symlink_to would refuse
+        if name in shared and name not in present:
+            (workspace / name).symlink_to(os.path.relpath(base / name, workspace))
+
+
 def _sync_workspace_links(workspace: Path) -> None:
     """Ensure symlinks in an existing workspace point to current shared files."""
-    base = Path(WORKING_DIR)
-    for fname in _SYMLINKED_FILES:
-        src = base / fname
-        dst = workspace / fname
-        if src.exists() and not dst.exists():
-            dst.symlink_to(os.path.relpath(src, workspace))
-    for dname in _SYMLINKED_DIRS:
-        src = base / dname
-        dst = workspace / dname
-        if src.exists() and not dst.exists():
-            dst.symlink_to(os.path.relpath(src, workspace))
+    _link_shared(workspace, _entry_names(workspace))
+
+
+# Directories known to exist, so hot paths skip repeated mkdir syscalls.
+# Cleared wholesale past a size cap (one entry per chat/thread/day).
+_seen_dirs: set[Path] = set()
+_SEEN_DIRS_MAX = 4096
+
+
+def ensure_dir(path: Path) -> Path:
+    """mkdir -p, at most once per directory per process."""
+    if path not in _seen_dirs:
+        path.mkdir(parents=True, exist_ok=True)
+        if len(_seen_dirs) >= _SEEN_DIRS_MAX:
+            _seen_dirs.clear()
+        _seen_dirs.add(path)
+    return path
+
+
+def forget_dirs(root: Path) -> None:
+    """Drop cached directories at or under root (call after deleting it)."""
+    _seen_dirs.difference_update(
+        [p for p in _seen_dirs if p == root or root in p.parents]
+    )
+
+
+@functools.lru_cache(maxsize=1024)
+def upload_dir(chat_id: int, thread_id: int, sub: str) -> Path:
+    """Return workspaces/c{chat_id}/uploads/t{thread_id}/{sub} (not created).
+
+    Memoized so the per-message media path costs one Path join, not four.
+    """
+    return WORKSPACES_DIR / f"c{chat_id}" / "uploads" / f"t{thread_id}" / sub
 
 
 def get_working_dir(chat_id: int) -> str:
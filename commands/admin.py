@@ -14,8 +14,8 @@ from bot.config import (
     is_authorized, get_claude_model, get_thread_id,
 )
 from bot.logging_setup import logger, infra_logger
-from bot.sessions import load_sessions
-from bot.streams import load_active_streams
+from bot.sessions import format_updated_at, load_sessions
+from bot.streams import active_stream_count, flush_active_streams
 from bot.renderer import split_message
 
 COMMANDS = [
@@ -51,11 +51,11 @@ async def cmd_sessions(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     lines = [f"<b>Active Sessions ({len(sessions)})</b>\n"]
     for key, data in sessions.items():
         sid = data.get("session_id", "?")
-        updated = data.get("updated_at", "?")
+        updated = format_updated_at(data.get("updated_at", "?"))
         lines.append(
             f"<code>{html.escape(key)}</code>\n"
             f"  session: <code>{html.escape(sid[:16])}...</code>\n"
-            f"  updated: {html.escape(str(updated))}"
+            f"  updated: {html.escape(updated)}"
         )
 
     text = "\n".join(lines)
@@ -107,6 +107,8 @@ async def cmd_restart(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     existing.append(entry)
     RESTART_MESSAGES_FILE.write_text(json.dumps(existing))
 
+    # restart.sh reads the registry file; write out any debounced changes first
+    flush_active_streams()
     subprocess.Popen(
         ["bash", str(restart_script)],
         cwd=str(SCRIPT_DIR),
@@ -202,13 +204,11 @@ async def cmd_usage(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             return f"{b / 1024:.0f}KB"
         return f"{b}B"
 
-    streams = load_active_streams()
-
     lines = [
         "<b>Usage Statistics</b>",
         "",
         f"<b>Sessions:</b> {len(sessions)}",
-        f"<b>Active streams:</b> {len(streams)}",
+        f"<b>Active streams:</b> {active_stream_count()}",
         f"<b>Workspaces:</b> {workspace_count}",
         f"<b>Uploads size:</b> {_fmt(total_upload_size)}",
         f"<b>Memory size:</b> {_fmt(total_memory_size)}",
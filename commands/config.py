@@ -30,17 +30,33 @@ def _settings_file() -> Path:
     return _SETTINGS_FILE
 
 
+# Parsed settings keyed by the file's (mtime_ns, size). should_respond()
+# consults the respond mode on every group message, so a stat replaces a
+# read + parse; edits made outside the bot still show up.
+_settings_cache: tuple[tuple[int, int], dict] | None = None
+
+
 def _load_settings() -> dict:
+    global _settings_cache
     f = _settings_file()
-    if f.exists():
-        try:
-            return json.loads(f.read_text())
-        except (json.JSONDecodeError, OSError):
-            pass
-    return {}
+    try:
+        st = f.stat()
+    except OSError:
+        return {}
+    stamp = (st.st_mtime_ns, st.st_size)
+    if _settings_cache is not None and _settings_cache[0] == stamp:
+        return _settings_cache[1]
+    try:
+        settings = json.loads(f.read_text())
+    except (json.JSONDecodeError, OSError):
+        return {}
+    _settings_cache = (stamp, settings)
+    return settings
 
 
 def _save_settings(settings: dict) -> None:
+    global _settings_cache
+    _settings_cache = None
     try:
         _settings_file().write_text(json.dumps(settings, indent=2))
     except OSError as e:
@@ -11,7 +11,7 @@ from telegram.ext import Application, CommandHandler, ContextTypes
 from bot.config import is_authorized, get_thread_id
 from bot.renderer import split_message
 from bot.workspaces import ensure_workspace
-from bot.handlers import run_with_streaming
+from bot.handlers import ctx_from_update, run_with_streaming
 
 # (command_name, description) — used by /start listing
 COMMANDS = [
@@ -139,8 +139,8 @@ async def cmd_forget(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
         await update.message.reply_text("Usage: /forget <what to forget>")
         return
 
-    chat_id = update.effective_chat.id
-    thread_id = get_thread_id(update)
+    ctx = ctx_from_update(update)
+    thread_id = ctx.thread_id
 
     prompt = (
         f"[System command: /forget]\n"
@@ -151,7 +151,7 @@ async def cmd_forget(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
         f"Then confirm what you removed."
     )
 
-    await run_with_streaming(update, context, chat_id, thread_id, user.id, prompt)
+    await run_with_streaming(update, context, ctx, prompt)
 
 
 async def cmd_history(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -160,9 +160,6 @@ async def cmd_history(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     if not is_authorized(user.id):
         return
 
-    chat_id = update.effective_chat.id
-    thread_id = get_thread_id(update)
-
     prompt = (
         "[System command: /history]\n"
         "The user wants a summary of this conversation. "
@@ -170,7 +167,7 @@ async def cmd_history(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         "and any pending items. Keep it brief — this is for quick reference."
     )
 
-    await run_with_streaming(update, context, chat_id, thread_id, user.id, prompt)
+    await run_with_streaming(update, context, ctx_from_update(update), prompt)
 
 
 def register(app: Application) -> None:
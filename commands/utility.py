@@ -10,7 +10,7 @@ from telegram.ext import Application, CommandHandler, ContextTypes
 from bot.config import ADMIN_USER_ID, is_authorized, get_claude_model, set_claude_model, get_thread_id
 from bot.logging_setup import logger
 from bot.renderer import split_message
-from bot.workspaces import ensure_workspace
+from bot.workspaces import ensure_workspace, forget_dirs
 
 COMMANDS = [
     ("model", "Show or switch the Claude model"),
@@ -164,6 +164,7 @@ async def cmd_clean(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         size_str = f"{total_size / 1024:.0f}KB"
 
     shutil.rmtree(uploads_dir)
+    forget_dirs(uploads_dir)
     uploads_dir.mkdir(exist_ok=True)
 
     await update.message.reply_text(
@@ -0,0 +1,116 @@
+"""Tests for tool status formatting, finished lines and stream parsing."""
+
+import asyncio
+import json
+import logging
+import time
+
+import pytest
+
+from bot import claude
+from bot.claude import format_tool_status, finished_line, _DeltaBuffer, _iter_lines
+from bot.sessions import request_ctx
+
+
+class TestFormatToolStatus:
+    def test_read_uses_basename(self):
+        assert format_tool_status("Read", {"file_path": "/a/b/notes.md"}) == "\U0001f4c4 Reading notes.md..."
+
+    def test_bash_truncates_long_command(self):
+        status = format_tool_status("Bash", {"command": "x" * 80})
+        assert status == "⚙️ `" + "x" * 60 + "…`"
+
+    def test_bash_falls_back_to_description(self):
+        assert format_tool_status("Bash", {"description": "List files"}) == "⚙️ List files"
+
+    def test_write_and_edit_share_format(self):
+        assert format_tool_status("Write", {"file_path": "/x/a.py"}) == \
+            format_tool_status("Edit", {"file_path": "/y/a.py"})
+
+    def test_unknown_tool(self):
+        assert format_tool_status("Mystery", {}) == "\U0001f527 Using Mystery..."
+
+
+class TestFinishedLine:
+    def test_strips_prefix_and_ellipsis(self):
+        active = format_tool_status("Read", {"file_path": "/a/notes.md"})
+        assert finished_line(active) == "✓ Reading notes.md"
+
+    def test_variation_selector_prefix(self):
+        active = format_tool_status("Bash", {"command": "ls -la"})
+        assert finished_line(active) == "✓ `ls -la`"
+
+    def test_unknown_prefix_falls_back_to_first_space(self):
+        assert finished_line("* Doing things...") == "✓ Doing things"
+
+
+class TestDeltaBuffer:
+    def test_small_chunks_held_until_threshold(self):
+        buf = _DeltaBuffer()
+        buf.last_flush = float("inf")  # disable the time-based flush
+        assert buf.add("a" * 100) is None
+        assert buf.add("b" * 100) is None
+        out = buf.add("c" * 400)
+        assert out == "a" * 100 + "b" * 100 + "c" * 400
+        assert buf.flush() is None
+
+    def test_flush_returns_remainder(self):
+        buf = _DeltaBuffer()
+        buf.last_flush = float("inf")
+        buf.add("tail")
+        assert buf.flush() == "tail"
+
+
+class _FakeProc:
+    def __init__(self, lines):
+        self.stdout = asyncio.StreamReader()
+        self.stdout.feed_data(b"".join(json.dumps(e).encode() + b"\n" for e in lines))
+        self.stdout.feed_eof()
+        self.stderr = asyncio.StreamReader()
+        self.stderr.feed_eof()
+        self.returncode = 0
+
+    async def wait(self):
+        return 0
+
+
+class TestSubprocessStream:
+    async def test_trailing_deltas_flushed_at_end_of_stream(self, monkeypatch):
+        deltas = [
+            {"type": "stream_event", "event": {"delta": {"type": "text_delta", "text": t}}}
+            for t in ("hel", "lo")
+        ]
+
+        async def fake_exec(*args, **kwargs):
+            return _FakeProc(deltas)
+
+        monkeypatch.setattr(claude.asyncio, "create_subprocess_exec", fake_exec)
+        monkeypatch.setattr(claude, "_PARTIAL_FLUSH_INTERVAL", float("inf"))
+        monkeypatch.setattr(claude, "get_session_id", lambda *a: None)
+        monkeypatch.setattr(claude, "add_active_stream", lambda *a: None)
+        monkeypatch.setattr(claude, "remove_active_stream", lambda *a: None)
+        monkeypatch.setattr(claude, "build_env", lambda *a: {})
+        monkeypatch.setattr(claude, "get_workspace_logger", lambda chat_id: logging.getLogger("test"))
+
+        ctx = request_ctx(1, 0, 99, private=True)
+        events = [e async for e in claude._stream_claude_subprocess("hi", ctx, verbose=True)]
+        assert events[0] == {"type": "partial", "text": "hello"}
+        assert events[-1]["type"] == "error"  # still reports the missing result
+
+
+class TestIterLines:
+    @pytest.mark.asyncio
+    async def test_splits_across_chunk_boundaries(self, monkeypatch):
+        monkeypatch.setattr("bot.claude._READ_CHUNK", 5)
+        reader = asyncio.StreamReader()
+        reader.feed_data(b'{"a":1}\n{"b":2}\n\ntail')
+        reader.feed_eof()
+        lines = [line async for line in _iter_lines(reader, time.monotonic() + 5)]
+        assert lines == [b'{"a":1}', b'{"b":2}', b"", b"tail"]
+
+    @pytest.mark.asyncio
+    async def test_deadline_raises_timeout(self):
+        reader = asyncio.StreamReader()
+        with pytest.raises(asyncio.TimeoutError):
+            async for _ in _iter_lines(reader, time.monotonic() + 0.01):
+                pass
@@ -0,0 +1,175 @@
+"""Tests for media downloads."""
+
+import asyncio
+
+import httpx
+import pytest
+
+from bot import downloads
+from bot.downloads import download_file
+
+PAYLOAD = bytes(range(256)) * 40  # 10 KiB
+
+
+class _FakeFile:
+    def __init__(self, size, path="https://api.telegram.org/file/botX/documents/a b.bin"):
+        self.file_size = size
+        self.file_path = path
+        self.fallback_calls = 0
+
+    async def download_as_bytearray(self):
+        self.fallback_calls += 1
+        return bytearray(PAYLOAD)
+
+
+def _patch_client(monkeypatch, honour_range=True):
+    seen = []
+
+    def handler(request):
+        seen.append(request)
+        rng = request.headers.get("Range")
+        if not honour_range or not rng:
+            return httpx.Response(200, content=PAYLOAD)
+        lo, hi = (int(x) for x in rng.removeprefix("bytes=").split("-"))
+        return httpx.Response(206, content=PAYLOAD[lo:hi + 1])
+
+    real_client = httpx.AsyncClient
+    monkeypatch.setattr(
+        downloads.httpx, "AsyncClient",
+        lambda **kw: real_client(transport=httpx.MockTransport(handler), **kw),
+    )
+    return seen
+
+
+@pytest.fixture
+def small_threshold(monkeypatch):
+    monkeypatch.setattr(downloads, "PARALLEL_MIN_SIZE", 1024)
+
+
+class TestDownloadFile:
+    async def test_small_file_single_fetch(self, tmp_dir):
+        f = _FakeFile(size=len(PAYLOAD))
+        dest = tmp_dir / "out.bin"
+        await download_file(f, dest)
+        assert dest.read_bytes() == PAYLOAD
+        assert f.fallback_calls == 1
+
+    async def test_large_file_parallel_ranges(self, tmp_dir, monkeypatch, small_threshold):
+        seen = _patch_client(monkeypatch)
+        f = _FakeFile(size=len(PAYLOAD))
+        dest = tmp_dir / "out.bin"
+        await download_file(f, dest)
+        assert dest.read_bytes() == PAYLOAD
+        assert f.fallback_calls == 0
+        assert len(seen) == downloads.PARALLEL_PARTS
+        assert "a%20b.bin" in str(seen[0].url)
+
+    async def test_ranges_written_in_chunks(self, tmp_dir, monkeypatch, small_threshold):
+        _patch_client(monkeypatch)
+        monkeypatch.setattr(downloads, "RANGE_CHUNK", 100)
+        writes = []
+        real_pwrite = downloads.os.pwrite
+
+        def pwrite(fd, data, offset):
+            writes.append(len(data))
+            return real_pwrite(fd, data, offset)
+
+        monkeypatch.setattr(downloads.os, "pwrite", pwrite)
+        f = _FakeFile(size=len(PAYLOAD))
+        dest = tmp_dir / "out.bin"
+        await download_file(f, dest)
+        assert dest.read_bytes() == PAYLOAD
+        assert max(writes) <= 100
+
+    async def test_failed_range_stops_siblings_before_close(
+        self, tmp_dir, monkeypatch, small_threshold
+    ):
+        monkeypatch.setattr(downloads, "RANGE_CHUNK", 100)
+
+        async def body(lo, hi):
+            for start in range(lo, hi + 1, 100):
+                if lo == 0 and start > 0:
+                    raise httpx.ReadError("connection reset")
+                yield PAYLOAD[start:min(start + 100, hi + 1)]
+                await asyncio.sleep(0.001)
+
+        def handler(request):
+            lo, hi = (int(x) for x in request.headers["Range"].removeprefix("bytes=").split("-"))
+            return httpx.Response(206, content=body(lo, hi))
+
+        real_client = httpx.AsyncClient
+        monkeypatch.setattr(
+            downloads.httpx, "AsyncClient",
+            lambda **kw: real_client(transport=httpx.MockTransport(handler), **kw),
+        )
+        closed = set()
+        late_writes = []
+        real_close, real_pwrite = downloads.os.close, downloads.os.pwrite
+
+        def close(fd):
+            closed.add(fd)
+            real_close(fd)
+
+        def pwrite(fd, data, offset):
+            if fd in closed:
+                late_writes.append(offset)
+            return real_pwrite(fd, data, offset)
+
+        monkeypatch.setattr(downloads.os, "close", close)
+        monkeypatch.setattr(downloads.os, "pwrite", pwrite)
+        f = _FakeFile(size=len(PAYLOAD))
+        dest = tmp_dir / "out.bin"
+        await download_file(f, dest)
+        await asyncio.sleep(0.05)
+        assert late_writes == []
+        assert f.fallback_calls == 1
+        assert dest.read_bytes() == PAYLOAD
+
+    async def test_range_not_honoured_falls_back(self, tmp_dir, monkeypatch, small_threshold):
+        _patch_client(monkeypatch, honour_range=False)
+        f = _FakeFile(size=len(PAYLOAD))
+        dest = tmp_dir / "out.bin"
+        await download_file(f, dest)
+        assert dest.read_bytes() == PAYLOAD
+        assert f.fallback_calls == 1
+
+    async def test_missing_parent_recreated(self, tmp_dir):
+        f = _FakeFile(size=len(PAYLOAD))
+        dest = tmp_dir / "gone" / "out.bin"
+        await download_file(f, dest)
+        assert dest.read_bytes() == PAYLOAD
+
+    async def test_concurrency_capped(self, tmp_dir, monkeypatch):
+        monkeypatch.setattr(downloads, "_download_slots", asyncio.Semaphore(2))
+        active = peak = 0
+
+        async def slow_download(file, dest):
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+
+        monkeypatch.setattr(downloads, "_download", slow_download)
+        await asyncio.gather(*(download_file(None, tmp_dir / f"{i}.bin") for i in range(6)))
+        assert peak == 2
+
+    async def test_failed_download_leaves_no_part(self, tmp_dir):
+        class _Broken(_FakeFile):
+            async def download_as_bytearray(self):
+                raise OSError("connection reset")
+
+        dest = tmp_dir / "out.bin"
+        with pytest.raises(OSError):
+            await download_file(_Broken(size=10), dest)
+        assert list(tmp_dir.iterdir()) == []
+
+
+class TestPrunePartialDownloads:
+    def test_removes_only_part_files(self, tmp_dir):
+        day = tmp_dir / "c1" / "uploads" / "t0" / "2026-01-01"
+        day.mkdir(parents=True)
+        (day / "a.jpg.part").write_bytes(b"x")
+        (day / "b.jpg").write_bytes(b"x")
+        assert downloads.prune_partial_downloads(tmp_dir) == 1
+        assert [p.name for p in day.iterdir()] == ["b.jpg"]
@@ -0,0 +1,144 @@
+"""Tests for handler helpers."""
+
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from bot import handlers
+from bot.handlers import _safe_name
+from bot.sessions import request_ctx
+
+
+class TestSafeName:
+    def test_strips_directories(self):
+        assert _safe_name("a/b/report.pdf", "x") == "report.pdf"
+        assert _safe_name("C:\\Users\\me\\report.pdf", "x") == "report.pdf"
+
+    def test_rejects_hidden_and_traversal(self):
+        assert _safe_name(".bashrc", "x") == "bashrc"
+        assert _safe_name("..", "fallback") == "fallback"
+        assert _safe_name("a\0b.txt", "x") == "ab.txt"
+
+    def test_missing_name_uses_fallback(self):
+        assert _safe_name(None, "file_1") == "file_1"
+        assert _safe_name("dir/", "file_1") == "file_1"
+
+
+class TestBotMention:
+    def teardown_method(self):
+        handlers.set_bot_username("")
+
+    def test_strip_mention_case_insensitive(self):
+        handlers.set_bot_username("MyBot")
+        assert handlers.strip_bot_mention("@mybot hello") == "hello"
+        assert handlers.strip_bot_mention("@MyBotter hi") == "@MyBotter hi"
+
+    def test_no_username_leaves_text(self):
+        assert handlers.strip_bot_mention(" @x hi ") == " @x hi "
+
+    def test_should_respond_to_mention_only(self):
+        handlers.set_bot_username("MyBot")
+
+        def group_msg(text, *mentions):
+            entities = [SimpleNamespace(type="mention", offset=text.index(m), length=len(m))
+                        for m in mentions]
+            msg = SimpleNamespace(text=text, entities=entities, reply_to_message=None)
+            return SimpleNamespace(effective_chat=SimpleNamespace(type="group", id=1),
+                                   message=msg)
+
+        assert handlers.should_respond(group_msg("hey @MYBOT", "@MYBOT"))
+        with patch("commands.config.get_respond_mode", return_value="mention"), \
+                patch.object(handlers, "get_thread_id", return_value=0):
+            # Same length as the bot's mention, different user
+            assert not handlers.should_respond(group_msg("@OtBot hi", "@OtBot"))
+            assert not handlers.should_respond(group_msg("@MyBotter hi", "@MyBotter"))
+
+
+class TestFlushBatch:
+    async def _flush(self, *items):
+        async def fail():
+            raise OSError("connection reset")
+
+        async def ok():
+            return "photo"
+
+        message = SimpleNamespace(reply_text=AsyncMock())
+        update = SimpleNamespace(message=message)
+        ctx = request_ctx(1, 5, 99, private=False)
+        buffer = [asyncio.create_task(fail() if item == "fail" else ok()) for item in items]
+        handlers._batches[ctx.key] = handlers._BatchState(
+            buffer=buffer, timer=None, update_ctx=(update, None), req=ctx,
+        )
+        with patch.object(handlers, "run_with_streaming", AsyncMock()) as run:
+            await handlers._flush_batch(ctx.key)
+        return message.reply_text, run
+
+    async def test_all_failed_replies_with_notice(self):
+        reply, run = await self._flush("fail", "fail")
+        reply.assert_awaited_once_with("[Download failed]", message_thread_id=5)
+        run.assert_not_awaited()
+
+    async def test_partial_failure_sends_the_rest(self):
+        reply, run = await self._flush("fail", "ok")
+        reply.assert_not_awaited()
+        assert run.await_args.args[-1] == "photo"
+
+    async def test_slow_voice_batch_reaches_claude_before_later_text(self):
+        sent = []
+
+        async def record(update, context, ctx, message):
+            sent.append(message)
+
+        async def slow_transcribe():
+            await asyncio.sleep(0.1)
+            return "voice"
+
+        update = SimpleNamespace(message=SimpleNamespace(reply_text=AsyncMock()))
+        ctx = request_ctx(1, 5, 99, private=False)
+        with patch.object(handlers, "BATCH_WINDOW", 0.01), \
+                patch.object(handlers, "run_with_streaming", record):
+            await handlers.queue_message(update, None, ctx, asyncio.create_task(slow_transcribe()))
+            await asyncio.sleep(0.03)  # voice batch closed, still transcribing
+            await handlers.queue_message(update, None, ctx, "text")
+            await asyncio.sleep(0.2)
+        assert sent == ["voice", "text"]
+        assert ctx.key not in handlers._flush_tails
+
+    async def test_album_still_downloading_reaches_claude_before_later_text(self, tmp_dir):
+        sent = []
+
+        async def record(update, context, ctx, message):
+            sent.append(message)
+
+        async def slow_download(file, dest):
+            await asyncio.sleep(0.1)
+
+        message = SimpleNamespace(reply_text=AsyncMock(), media_group_id="album")
+        update = SimpleNamespace(message=message)
+        context = SimpleNamespace(bot=SimpleNamespace(get_file=AsyncMock()))
+        ctx = request_ctx(1, 5, 99, private=False)
+        with patch.object(handlers, "BATCH_WINDOW", 0.01), \
+                patch.object(handlers, "download_file", slow_download), \
+                patch.object(handlers, "run_with_streaming", record):
+            for i in range(2):
+                await handlers._download_and_queue(
+                    update, context, ctx, f"f{i}", tmp_dir / f"{i}.jpg", f"photo {i}",
+                )
+            await asyncio.sleep(0.03)  # album batch closed, still downloading
+            await handlers.queue_message(update, context, ctx, "text")
+            await asyncio.sleep(0.2)
+        assert sent == ["photo 0\n\nphoto 1", "text"]
+
+
+class TestRunWithStreaming:
+    async def test_setup_failure_leaves_no_writer_tasks(self):
+        update = SimpleNamespace(message=SimpleNamespace(reply_text=AsyncMock()))
+        ctx = request_ctx(1, 5, 99, private=False)
+        before = asyncio.all_tasks()
+        with patch.object(handlers, "get_working_dir", side_effect=OSError("gone")), \
+                pytest.raises(OSError):
+            await handlers.run_with_streaming(update, None, ctx, "hi")
+        await asyncio.sleep(0)
+        assert asyncio.all_tasks() == before
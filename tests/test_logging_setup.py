@@ -0,0 +1,37 @@
+"""Tests for workspace logger caching."""
+
+import logging
+from unittest.mock import patch
+
+from bot import logging_setup
+from bot.logging_setup import get_workspace_logger
+
+
+class TestWorkspaceLogger:
+    def teardown_method(self):
+        for chat_id in (-1, -2):
+            logging_setup._workspace_loggers.pop(chat_id, None)
+            ws_logger = logging.getLogger(f"OpenClaude.ws.{chat_id}")
+            for handler in list(ws_logger.handlers):
+                ws_logger.removeHandler(handler)
+                handler.close()
+
+    def test_eviction_releases_file_but_logger_keeps_working(self, tmp_dir):
+        with patch.object(logging_setup, "WORKSPACES_DIR", tmp_dir), \
+                patch.object(logging_setup._workspace_loggers, "maxsize", 1):
+            first = get_workspace_logger(-1)
+            assert get_workspace_logger(-1) is first
+            first.info("before")
+            handler = first.handlers[0]
+            assert handler.stream is not None
+
+            get_workspace_logger(-2)
+            assert handler.stream is None
+
+            # A caller still holding the evicted logger can keep logging
+            first.info("after")
+            log = (tmp_dir / "c-1" / "logs" / "activity.log").read_text()
+            assert "before" in log and "after" in log
+
+            # Re-admitting the chat reuses the existing handler
+            assert get_workspace_logger(-1).handlers == [handler]
@@ -0,0 +1,39 @@
+"""Tests for the bounded LRU registry."""
+
+from bot.lru import LRUDict
+
+
+class TestLRUDict:
+    def test_evicts_least_recently_used(self):
+        d = LRUDict(2)
+        d["a"] = 1
+        d["b"] = 2
+        d["a"]  # touch
+        d["c"] = 3
+        assert list(d) == ["a", "c"]
+
+    def test_on_evict_called(self):
+        evicted = []
+        d = LRUDict(1, on_evict=lambda k, v: evicted.append((k, v)))
+        d["a"] = 1
+        d["b"] = 2
+        assert evicted == [("a", 1)]
+
+    def test_pinned_entries_survive(self):
+        d = LRUDict(1, pinned=lambda v: v == "held")
+        d["a"] = "held"
+        d["b"] = "free"
+        d["c"] = "free"
+        assert "a" in d
+        assert "c" in d
+        assert "b" not in d
+
+    def test_get_and_setdefault_refresh_order(self):
+        d = LRUDict(2)
+        d["a"] = 1
+        d["b"] = 2
+        assert d.get("a") == 1
+        assert d.setdefault("b", 9) == 2
+        d["c"] = 3
+        assert "a" not in d
+        assert d.get("missing") is None
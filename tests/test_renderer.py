@@ -1,6 +1,9 @@
 """Tests for TelegramRenderer and split_message."""
 
-from bot.renderer import TelegramRenderer, split_message
+from bot.config import TELEGRAM_MAX_LENGTH
+from bot.renderer import (
+    TelegramRenderer, is_balanced_html, iter_split_message, split_message, strip_tags,
+)
 
 
 class TestTelegramRenderer:
@@ -23,6 +26,10 @@ class TestTelegramRenderer:
         result = TelegramRenderer.render("use `foo()` here")
         assert "<code>foo()</code>" in result
 
+    def test_stray_backtick_before_code_block(self):
+        result = TelegramRenderer.render("a `b```\ncode\n```")
+        assert result == "a `b<pre>code\n</pre>"
+
     def test_link(self):
         result = TelegramRenderer.render("[click](https://example.com)")
         assert '<a href="https://example.com">click</a>' in result
@@ -36,6 +43,10 @@ class TestTelegramRenderer:
         assert "\u2022 item one" in result
         assert "\u2022 item two" in result
 
+    def test_mixed_lists(self):
+        result = TelegramRenderer.render("1. first\n- sub\n2. second")
+        assert result == "1. first\n  \u2022 sub\n  2. second"
+
     def test_empty_string(self):
         assert TelegramRenderer.render("") == ""
 
@@ -53,6 +64,13 @@ class TestSplitMessage:
     def test_no_split_needed(self):
         assert split_message("short", max_length=100) == ["short"]
 
+    def test_exact_limit_not_split(self):
+        text = "word " * (TELEGRAM_MAX_LENGTH // 5)
+        text = text[:TELEGRAM_MAX_LENGTH]
+        chunks = split_message(text)
+        assert len(chunks) == 1
+        assert chunks[0] is text
+
     def test_splits_at_paragraph(self):
         text = "A" * 50 + "\n\n" + "B" * 50
         chunks = split_message(text, max_length=80)
@@ -71,3 +89,51 @@ class TestSplitMessage:
         assert len(chunks) >= 2
         total = sum(len(c) for c in chunks)
         assert total == 200
+
+
+class TestRenderCache:
+    def test_repeat_render_hits_cache(self):
+        TelegramRenderer._render_cached.cache_clear()
+        first = TelegramRenderer.render("**cached**")
+        second = TelegramRenderer.render("**cached**")
+        assert first == second
+        assert TelegramRenderer._render_cached.cache_info().hits == 1
+
+    def test_oversized_text_not_cached(self):
+        TelegramRenderer._render_cached.cache_clear()
+        text = "**big** " * 1000
+        assert TelegramRenderer.render(text) == TelegramRenderer.render(text)
+        assert TelegramRenderer._render_cached.cache_info().currsize == 0
+
+
+class TestStripTags:
+    def test_removes_tags_keeps_text(self):
+        assert strip_tags('<b>bold</b> and <a href="x">link</a>') == "bold and link"
+
+    def test_decodes_entities(self):
+        rendered = TelegramRenderer.render("a < b && `x>y`")
+        assert strip_tags(rendered) == "a < b && x>y"
+
+
+class TestIsBalancedHtml:
+    def test_rendered_markdown_is_balanced(self):
+        rendered = TelegramRenderer.render("# T\n**b** [l](u) `c`\n```py\nx\n```")
+        assert is_balanced_html(rendered)
+        assert is_balanced_html("plain &lt;text&gt;")
+
+    def test_mis_nested_or_unclosed(self):
+        assert not is_balanced_html(TelegramRenderer.render("***x***"))
+        assert not is_balanced_html("<b>open")
+        assert not is_balanced_html("close</i>")
+
+
+class TestIterSplitMessage:
+    def test_matches_split_message(self):
+        text = ("word " * 300 + "\n\n") * 20
+        chunks = list(iter_split_message(text, 1000))
+        assert chunks == split_message(text, 1000)
+        assert all(len(c) <= 1000 for c in chunks)
+
+    def test_is_lazy(self):
+        gen = iter_split_message("a " * 10_000, 100)
+        assert len(next(gen)) <= 100
@@ -0,0 +1,114 @@
+"""Tests for SDK session idle expiry and connection state."""
+
+import asyncio
+from unittest.mock import patch
+
+from bot import sdk_session
+from bot.sdk_session import SDKSession, mark_active, cleanup_idle_sessions
+
+
+class TestIdleExpiry:
+    def setup_method(self):
+        sdk_session.sdk_sessions.clear()
+        sdk_session._expiry_heap.clear()
+
+    def test_mark_active_pushes_deadline(self):
+        session = SDKSession()
+        mark_active("1:0:99", session)
+        expiry, key = sdk_session._expiry_heap[0]
+        assert key == "1:0:99"
+        assert expiry == session.last_activity + sdk_session.SDK_IDLE_TIMEOUT
+
+    async def test_expired_session_disconnected(self):
+        session = SDKSession()
+        sdk_session.sdk_sessions["1:0:99"] = session
+        with patch("bot.sdk_session.SDK_IDLE_TIMEOUT", 0):
+            mark_active("1:0:99", session)
+            task = asyncio.create_task(cleanup_idle_sessions())
+            await asyncio.sleep(0.05)
+            task.cancel()
+        assert "1:0:99" not in sdk_session.sdk_sessions
+        assert not sdk_session._expiry_heap
+
+    async def test_stale_entry_skipped(self):
+        session = SDKSession()
+        sdk_session.sdk_sessions["1:0:99"] = session
+        # Deadline already passed, but the session was touched since
+        sdk_session._expiry_heap.append((0.0, "1:0:99"))
+        mark_active("1:0:99", session)
+        task = asyncio.create_task(cleanup_idle_sessions())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        assert sdk_session.sdk_sessions["1:0:99"] is session
+
+
+class _FakeClient:
+    connects = 0
+    fail_next = False
+
+    def __init__(self, options=None):
+        self.options = options
+
+    async def connect(self):
+        if _FakeClient.fail_next:
+            _FakeClient.fail_next = False
+            raise RuntimeError("boom")
+        _FakeClient.connects += 1
+
+    async def disconnect(self):
+        pass
+
+
+class TestConnectionState:
+    def setup_method(self):
+        _FakeClient.connects = 0
+        _FakeClient.fail_next = False
+
+    async def test_concurrent_connect_only_once(self):
+        session = SDKSession()
+        with patch("bot.sdk_session.ClaudeSDKClient", _FakeClient):
+            await asyncio.gather(*(session.ensure_connected(None) for _ in range(5)))
+        assert _FakeClient.connects == 1
+        assert session.state == sdk_session.CONNECTED
+
+    async def test_failed_connect_marks_broken_then_recovers(self):
+        session = SDKSession()
+        _FakeClient.fail_next = True
+        with patch("bot.sdk_session.ClaudeSDKClient", _FakeClient):
+            try:
+                await session.ensure_connected(None)
+            except RuntimeError:
+                pass
+            assert session.state == sdk_session.BROKEN
+            await session.ensure_connected(None)
+        assert session.connected
+
+    async def test_mark_broken_keeps_registration(self):
+        session = SDKSession()
+        sdk_session.sdk_sessions["1:0:99"] = session
+        with patch("bot.sdk_session.ClaudeSDKClient", _FakeClient):
+            await session.ensure_connected(None)
+            await session.mark_broken()
+            assert sdk_session.sdk_sessions["1:0:99"] is session
+            assert session.client is None
+            await session.ensure_connected(None)
+        assert _FakeClient.connects == 2
+        sdk_session.sdk_sessions.clear()
+
+
+class TestEviction:
+    def setup_method(self):
+        sdk_session.sdk_sessions.clear()
+
+    def teardown_method(self):
+        sdk_session.sdk_sessions.clear()
+
+    async def test_busy_session_survives_insert_at_capacity(self):
+        with patch.object(sdk_session.sdk_sessions, "maxsize", 2):
+            busy, idle = SDKSession(), SDKSession()
+            busy.in_use = 1
+            sdk_session.sdk_sessions["busy"] = busy
+            sdk_session.sdk_sessions["idle"] = idle
+            sdk_session.sdk_sessions["new"] = SDKSession()
+            await asyncio.sleep(0)
+        assert list(sdk_session.sdk_sessions) == ["busy", "new"]
@@ -1,13 +1,24 @@
 """Tests for session persistence."""
 
+import asyncio
 import json
 from pathlib import Path
 from unittest.mock import patch
 
+import pytest
+
 from bot.sessions import (
     session_key, load_sessions, save_sessions,
-    get_session_id, set_session_id, clear_session,
+    get_session_id, set_session_id, clear_session, request_ctx,
+    format_updated_at,
 )
+from bot import sessions as sessions_mod
+
+
+def _reload() -> dict:
+    """Drop the in-memory copy and read the mapping back from disk."""
+    sessions_mod._sessions = None
+    return load_sessions()
 
 
 def test_session_key_format():
@@ -47,3 +58,82 @@ class TestSessionLifecycle:
             assert get_session_id(1, 0, 99) == "sess-abc"
             clear_session(1, 0, 99)
             assert get_session_id(1, 0, 99) is None
+
+    def test_updated_at_is_epoch_seconds(self, tmp_dir):
+        sf = tmp_dir / "sessions.json"
+        with patch("bot.sessions.SESSION_FILE", sf):
+            set_session_id(1, 0, 99, "sess-abc")
+            updated = load_sessions()["1:0:99"]["updated_at"]
+            assert isinstance(updated, int)
+            assert format_updated_at(updated).count(":") == 2
+            # Files written before the switch still hold ISO strings
+            assert format_updated_at("2025-01-01T10:00:00") == "2025-01-01T10:00:00"
+
+
+    @pytest.mark.asyncio
+    async def test_updates_debounced_inside_loop(self, tmp_dir):
+        sf = tmp_dir / "sessions.json"
+        with patch("bot.sessions.SESSION_FILE", sf), \
+                patch("bot.sessions.FLUSH_DELAY", 0.01):
+            set_session_id(1, 0, 99, "s1")
+            set_session_id(1, 0, 99, "s2")
+            assert get_session_id(1, 0, 99) == "s2"
+            log = sf.with_suffix(".jsonl")
+            assert not log.exists()
+            await asyncio.sleep(0.05)
+            assert len(log.read_text().splitlines()) == 1
+            assert _reload()["1:0:99"]["session_id"] == "s2"
+
+    def test_log_replayed_over_snapshot(self, tmp_dir):
+        sf = tmp_dir / "sessions.json"
+        with patch("bot.sessions.SESSION_FILE", sf):
+            snapshot = {"1:0:1": {"session_id": "gone"}, "1:0:2": {"session_id": "keep"}}
+            save_sessions(dict(snapshot))
+            set_session_id(1, 0, 99, "new")
+            clear_session(1, 0, 1)
+            assert json.loads(sf.read_text()) == snapshot
+            reloaded = _reload()
+            assert set(reloaded) == {"1:0:2", "1:0:99"}
+            assert reloaded["1:0:99"]["session_id"] == "new"
+
+    def test_torn_log_line_ignored(self, tmp_dir):
+        sf = tmp_dir / "sessions.json"
+        with patch("bot.sessions.SESSION_FILE", sf):
+            set_session_id(1, 0, 99, "s1")
+            with open(sf.with_suffix(".jsonl"), "a") as f:
+                f.write('{"key": "1:0:99", "entry": {"sess')
+            assert _reload()["1:0:99"]["session_id"] == "s1"
+            set_session_id(2, 0, 99, "s2")
+            sessions = _reload()
+            assert sessions["1:0:99"]["session_id"] == "s1"
+            assert sessions["2:0:99"]["session_id"] == "s2"
+
+    def test_compaction_folds_log_into_snapshot(self, tmp_dir):
+        sf = tmp_dir / "sessions.json"
+        with patch("bot.sessions.SESSION_FILE", sf), \
+                patch("bot.sessions.COMPACT_RATIO", 1), \
+                patch("bot.sessions.COMPACT_MIN_LINES", 3):
+            for i in range(5):
+                set_session_id(1, 0, 99, f"s{i}")
+            assert json.loads(sf.read_text())["1:0:99"]["session_id"] == "s3"
+            assert len(sf.with_suffix(".jsonl").read_text().splitlines()) == 1
+            assert _reload()["1:0:99"]["session_id"] == "s4"
+
+
+class TestRequestCtx:
+    def test_private_chat_uses_sender(self):
+        ctx = request_ctx(1, 0, 99, private=True)
+        assert ctx.session_uid == 99
+        assert ctx.key == "1:0:99"
+
+    def test_group_shares_session(self):
+        ctx = request_ctx(-100, 7, 99, private=False)
+        assert ctx.user_id == 99
+        assert ctx.session_uid == 0
+        assert ctx.key == "-100:7:0"
+
+    def test_admin_flag(self):
+        with patch("bot.sessions.ADMIN_USER_ID", 99):
+            assert request_ctx(1, 0, 99).is_admin is True
+            assert request_ctx(1, 0, 98).is_admin is False
+            assert request_ctx(-100, 0, 99, private=False).is_admin is False
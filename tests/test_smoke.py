@@ -35,6 +35,14 @@ def test_import_bot_sdk_session():
     importlib.import_module("bot.sdk_session")
 
 
+def test_import_bot_lru():
+    importlib.import_module("bot.lru")
+
+
+def test_import_bot_downloads():
+    importlib.import_module("bot.downloads")
+
+
 def test_import_bot_claude():
     importlib.import_module("bot.claude")
 
@@ -1,14 +1,26 @@
 """Tests for active stream tracking."""
 
+import asyncio
 from pathlib import Path
 from unittest.mock import patch
 
+import pytest
+
+from bot import streams as streams_mod
 from bot.streams import (
-    add_active_stream, remove_active_stream,
+    add_active_stream, remove_active_stream, flush_active_streams, active_stream_count,
     load_active_streams, save_active_streams,
 )
 
 
+@pytest.fixture(autouse=True)
+def reset_registry():
+    streams_mod._active_streams.clear()
+    yield
+    streams_mod._active_streams.clear()
+    streams_mod._dirty = False
+
+
 class TestActiveStreams:
     def test_add_and_remove(self, tmp_dir):
         sf = tmp_dir / "streams.json"
@@ -45,3 +57,26 @@ class TestActiveStreams:
             streams = load_active_streams()
             assert len(streams) == 1
             assert "2:0:88" in streams
+
+    @pytest.mark.asyncio
+    async def test_writes_debounced_inside_loop(self, tmp_dir):
+        sf = tmp_dir / "streams.json"
+        with patch("bot.streams.ACTIVE_STREAMS_FILE", sf), \
+                patch("bot.streams.FLUSH_DELAY", 0.01):
+            add_active_stream(1, 0, 99)
+            add_active_stream(2, 0, 88)
+            assert not sf.exists()
+            assert active_stream_count() == 2
+            await asyncio.sleep(0.05)
+            assert len(load_active_streams()) == 2
+
+    @pytest.mark.asyncio
+    async def test_explicit_flush(self, tmp_dir):
+        sf = tmp_dir / "streams.json"
+        with patch("bot.streams.ACTIVE_STREAMS_FILE", sf):
+            add_active_stream(1, 0, 99)
+            flush_active_streams()
+            assert "1:0:99" in load_active_streams()
+            remove_active_stream(1, 0, 99)
+            flush_active_streams()
+            assert not sf.exists()
@@ -0,0 +1,81 @@
+"""Tests for voice transcription."""
+
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+import transcribe
+
+
+class _FakeClient:
+    def __init__(self):
+        self.calls = 0
+        self.timeouts = 0
+        media = SimpleNamespace(transcribe_file=self.transcribe_file)
+        self.listen = SimpleNamespace(v1=SimpleNamespace(media=media))
+
+    def transcribe_file(self, request, **options):
+        self.calls += 1
+        assert options["request_options"]["timeout"] == transcribe.TRANSCRIBE_TIMEOUT
+        if self.timeouts:
+            self.timeouts -= 1
+            raise httpx.ReadTimeout("timed out")
+        alt = SimpleNamespace(transcript=f" text {len(request)} ")
+        return SimpleNamespace(results=SimpleNamespace(
+            channels=[SimpleNamespace(alternatives=[alt])]
+        ))
+
+
+@pytest.fixture
+def client(monkeypatch):
+    fake = _FakeClient()
+    monkeypatch.setenv("DEEPGRAM_API_KEY", "key")
+    transcribe.reload_config()
+    monkeypatch.setattr(transcribe, "_client", lambda api_key: fake)
+    monkeypatch.setattr(transcribe, "_transcripts", type(transcribe._transcripts)())
+    yield fake
+    monkeypatch.undo()
+    transcribe.reload_config()
+
+
+class TestTranscribe:
+    async def test_identical_audio_transcribed_once(self, tmp_dir, client):
+        a = tmp_dir / "a.ogg"
+        b = tmp_dir / "b.ogg"
+        a.write_bytes(b"voice")
+        b.write_bytes(b"voice")
+        results = await asyncio.gather(transcribe.transcribe(a), transcribe.transcribe(b))
+        assert results == ["text 5", "text 5"]
+        assert await transcribe.transcribe(a) == "text 5"
+        assert client.calls == 1
+
+    async def test_different_audio_not_shared(self, tmp_dir, client):
+        a = tmp_dir / "a.ogg"
+        b = tmp_dir / "b.ogg"
+        a.write_bytes(b"one")
+        b.write_bytes(b"two!")
+        assert await transcribe.transcribe(a) == "text 3"
+        assert await transcribe.transcribe(b) == "text 4"
+        assert client.calls == 2
+
+    async def test_missing_file_reports_failure(self, tmp_dir, client):
+        assert await transcribe.transcribe(tmp_dir / "gone.ogg") == "[Transcription failed]"
+        assert client.calls == 0
+
+    async def test_timeout_retried_once(self, tmp_dir, client, monkeypatch):
+        monkeypatch.setattr(transcribe, "_RETRY_DELAY", 0)
+        audio = tmp_dir / "a.ogg"
+        audio.write_bytes(b"voice")
+        client.timeouts = 1
+        assert await transcribe.transcribe(audio) == "text 5"
+        assert client.calls == 2
+
+    async def test_repeated_timeout_reports_failure(self, tmp_dir, client, monkeypatch):
+        monkeypatch.setattr(transcribe, "_RETRY_DELAY", 0)
+        audio = tmp_dir / "a.ogg"
+        audio.write_bytes(b"voice")
+        client.timeouts = transcribe._ATTEMPTS
+        assert await transcribe.transcribe(audio) == "[Transcription failed]"
+        assert client.calls == transcribe._ATTEMPTS
@@ -0,0 +1,65 @@
+"""Tests for workspace directory helpers."""
+
+from unittest.mock import patch
+
+from bot import workspaces
+from bot.workspaces import ensure_dir, forget_dirs, upload_dir
+
+
+class TestEnsureDir:
+    def setup_method(self):
+        workspaces._seen_dirs.clear()
+
+    def test_creates_once(self, tmp_dir):
+        target = tmp_dir / "uploads" / "t0" / "2026-01-01"
+        ensure_dir(target)
+        assert target.is_dir()
+        with patch.object(type(target), "mkdir") as mkdir:
+            ensure_dir(target)
+            mkdir.assert_not_called()
+
+    def test_forget_dirs_drops_subtree(self, tmp_dir):
+        uploads = tmp_dir / "uploads"
+        inner = uploads / "t0" / "voice"
+        other = tmp_dir / "memory"
+        ensure_dir(inner)
+        ensure_dir(other)
+        forget_dirs(uploads)
+        assert inner not in workspaces._seen_dirs
+        assert other in workspaces._seen_dirs
+
+
+class TestUploadDir:
+    def test_layout_matches_workspace(self):
+        path = upload_dir(42, 7, "2026-01-01")
+        assert path == workspaces.WORKSPACES_DIR / "c42" / "uploads" / "t7" / "2026-01-01"
+        assert upload_dir(42, 7, "2026-01-01") is path
+
+
+class TestEnsureWorkspace:
+    def setup_method(self):
+        workspaces._ready_workspaces.clear()
+
+    def test_rechecks_only_after_interval(self, tmp_dir):
+        with patch.object(workspaces, "WORKSPACES_DIR", tmp_dir / "ws"), \
+                patch.object(workspaces, "_sync_workspace_links") as sync:
+            ws = workspaces.ensure_workspace(5)
+            assert ws.is_dir()
+            assert workspaces.ensure_workspace(5) == ws
+            sync.assert_not_called()
+            with patch.object(workspaces, "WORKSPACE_RECHECK", 0):
+                workspaces.ensure_workspace(5)
+            sync.assert_called_once_with(ws)
+
+    def test_sync_links_only_missing_shared_entries(self, tmp_dir):
+        base = tmp_dir / "base"
+        (base / ".claude").mkdir(parents=True)
+        (base / "CLAUDE.md").write_text("shared")
+        ws = tmp_dir / "ws" / "c1"
+        ws.mkdir(parents=True)
+        (ws / "CLAUDE.md").write_text("local")
+        with patch.object(workspaces, "WORKING_DIR", str(base)):
+            workspaces._sync_workspace_links(ws)
+        assert (ws / ".claude").is_symlink()
+        assert not (ws / "CLAUDE.md").is_symlink()
+        assert not (ws / "TOOLS.md").exists()
@@ -2,49 +2,140 @@
 Transcription module for OpenClaude — converts voice messages to text.
 
 Uses Deepgram Nova-3 Multilingual API. Requires DEEPGRAM_API_KEY.
+
+Transcripts are punctuated only; set DEEPGRAM_SMART_FORMAT=1 for Deepgram's
+smart formatting (numerals, dates, etc.) at the cost of extra server time.
+
+At most TRANSCRIBE_CONCURRENCY requests run at once. Identical audio (e.g. a
+forwarded voice note) is transcribed once: concurrent callers share the
+in-flight request and later callers get the remembered transcript.
+
+Each request gets TRANSCRIBE_TIMEOUT seconds. The SDK retries connection
+errors and 429/5xx itself; a timed-out request is retried once here.
 """
 
 import asyncio
+import functools
+import hashlib
 import logging
 import os
+from collections import OrderedDict
 from pathlib import Path
 
+import httpx
+
+try:
+    from deepgram import DeepgramClient
+except ImportError:
+    DeepgramClient = None
+
 logger = logging.getLogger("OpenClaude.transcribe")
 
+TRANSCRIBE_CONCURRENCY = int(os.getenv("TRANSCRIBE_CONCURRENCY", "4"))
+TRANSCRIBE_TIMEOUT = float(os.getenv("TRANSCRIBE_TIMEOUT", "30"))
+_ATTEMPTS = 2
+_RETRY_DELAY = 0.2  # doubled per attempt
+_MAX_CACHED_TRANSCRIPTS = 256
+
+# Request settings, read once; call reload_config() after changing the env
+_api_key = ""
+_model = ""
+_language = ""
+_smart_format = False
+
+
+def reload_config() -> None:
+    """(Re)read the DEEPGRAM_* settings from the environment."""
+    global _api_key, _model, _language, _smart_format
+    _api_key = os.getenv("DEEPGRAM_API_KEY", "").strip()
+    _model = os.getenv("DEEPGRAM_MODEL", "nova-3")
+    _language = os.getenv("DEEPGRAM_LANGUAGE", "ru")
+    _smart_format = os.getenv("DEEPGRAM_SMART_FORMAT", "") == "1"
+
+
+reload_config()
+
+_slots = asyncio.Semaphore(TRANSCRIBE_CONCURRENCY)
+# audio hash + request options -> transcript, least recently used first
+_transcripts: OrderedDict[str, str] = OrderedDict()
+_inflight: dict[str, asyncio.Task] = {}
+
+
+@functools.lru_cache(maxsize=1)
+def _client(api_key: str):
+    """One client per key, so its HTTP connection pool is reused across calls."""
+    return DeepgramClient(api_key=api_key)
+
 
 async def transcribe(audio_path: Path) -> str:
     """Transcribe an audio file to text using Deepgram Nova-3."""
-    api_key = os.getenv("DEEPGRAM_API_KEY", "").strip()
+    api_key = _api_key
     if not api_key:
         logger.error("DEEPGRAM_API_KEY not set")
         return "[Transcription failed: DEEPGRAM_API_KEY not set]"
 
-    try:
-        from deepgram import DeepgramClient
-    except ImportError:
+    if DeepgramClient is None:
         logger.error("deepgram-sdk is not installed. Install: pip install deepgram-sdk")
         return "[Transcription failed: deepgram-sdk not installed]"
 
+    model, language, smart_format = _model, _language, _smart_format
+
     try:
-        client = DeepgramClient(api_key=api_key)
-        audio_bytes = audio_path.read_bytes()
+        audio = await asyncio.to_thread(audio_path.read_bytes)
+    except OSError:
+        logger.exception("Could not read audio file %s", audio_path)
+        return "[Transcription failed]"
+
+    digest = hashlib.blake2b(audio, digest_size=16).hexdigest()
+    key = f"{digest}|{model}|{language}|{smart_format}"
+    cached = _transcripts.get(key)
+    if cached is not None:
+        _transcripts.move_to_end(key)
+        return cached
+
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(
+            _transcribe_audio(key, api_key, audio, model, language, smart_format)
+        )
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    # Shielded so one caller being cancelled doesn't cancel the shared request
+    return await asyncio.shield(task)
 
-        model = os.getenv("DEEPGRAM_MODEL", "nova-3")
-        language = os.getenv("DEEPGRAM_LANGUAGE", "ru")
+
+async def _transcribe_audio(key: str, api_key: str, audio: bytes, model: str,
+                            language: str, smart_format: bool) -> str:
+    try:
+        client = _client(api_key)
 
         def _transcribe() -> str:
             response = client.listen.v1.media.transcribe_file(
-                request=audio_bytes,
+                request=audio,
                 model=model,
                 language=language,
-                smart_format=True,
+                punctuate=True,
+                smart_format=smart_format,
+                request_options={"timeout": TRANSCRIBE_TIMEOUT},
             )
             return response.results.channels[0].alternatives[0].transcript
 
-        text = await asyncio.to_thread(_transcribe)
+        for attempt in range(_ATTEMPTS):
+            try:
+                async with _slots:
+                    text = await asyncio.to_thread(_transcribe)
+                break
+            except httpx.TimeoutException:
+                if attempt == _ATTEMPTS - 1:
+                    raise
+                logger.warning("Deepgram request timed out, retrying")
+                await asyncio.sleep(_RETRY_DELAY * 2 ** attempt)
         text = text.strip() if text else ""
         if not text:
             return "[Transcription produced no text]"
+        _transcripts[key] = text
+        if len(_transcripts) > _MAX_CACHED_TRANSCRIPTS:
+            _transcripts.popitem(last=False)
         return text
     except Exception as e:
         logger.exception("Deepgram transcription failed")